@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Generates synthetic lunch menus in the format of Eurest's all.json.
+
+Usage: python benchmarks/generate_payload.py [--days N] [--counters N]
+           [--dishes N] [--locales de,en] [--additives N] [--seed N] [output]
+"""
+import datetime
+import json
+import random
+import sys
+import time
+from optparse import OptionParser
+
+weekDays = [u"mon", u"tue", u"wed", u"thu", u"fri", u"sat", u"sun"]
+
+# counter titles per locale; the first counter of a day is always the soup
+counterTitles = {u"de" : [u"SUPPE", u"HAUPTGANG %d", u"HAUPTGANG %d (Vegetarisch)", u"BEILAGEN", u"DESSERT"],
+                 u"en" : [u"SOUP", u"MAIN COURSE %d", u"MAIN COURSE %d (Vegetarian)", u"SIDE DISH", u"DESSERT"]}
+
+words = {u"de" : [u"Käse", u"Spätzle", u"Hähnchen", u"Curry", u"Röstzwiebeln", u"Linsen", u"Kartoffel",
+                  u"Brokkoli", u"Rahm", u"Soße", u"Reis", u"Pudding", u"Apfel", u"Gemüse", u"Nudeln"],
+         u"en" : [u"cheese", u"noodles", u"chicken", u"curry", u"onions", u"lentils", u"potato",
+                  u"broccoli", u"cream", u"sauce", u"rice", u"pudding", u"apple", u"vegetables", u"pasta"]}
+
+def _text(rand, locale, count):
+    vocabulary = words.get(locale, words[u"en"])
+    return u" ".join(rand.choice(vocabulary) for _ in range(count)).capitalize()
+
+def _counterTitle(locale, index):
+    titles = counterTitles.get(locale, counterTitles[u"en"])
+    if index == 0:
+        return titles[0]
+    title = titles[1 + (index - 1) % (len(titles) - 1)]
+    return title % index if u"%d" in title else title
+
+def generatePayload(days=5, counters=5, dishes=2, locales=(u"de", u"en"), additives=14, seed=0, startDate=None):
+    """Returns a dict shaped like Eurest's all.json.
+
+    days -- number of lunch days, weekends are skipped
+    counters -- counters per day, cycling through soup, main course,
+                vegetarian main course, side dishes and dessert
+    dishes -- dishes per counter
+    """
+    rand = random.Random(seed)
+    if startDate == None:
+        startDate = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday())
+
+    additiveIds = [unicode(i + 1) for i in range(additives)]
+    settings = {u"additives" : [{u"id" : additiveId,
+                                 u"text" : dict((locale, u"%s %s" % (_text(rand, locale, 1), additiveId)) for locale in locales)}
+                                for additiveId in additiveIds]}
+
+    menu = []
+    lunchDate = startDate
+    while len(menu) < days:
+        if lunchDate.weekday() < 5:
+            dayCounters = []
+            for counterIndex in range(counters):
+                dayDishes = []
+                for _ in range(dishes):
+                    dish = {u"title" : dict((locale, _text(rand, locale, 2)) for locale in locales)}
+                    if rand.random() < 0.5:
+                        dish[u"description"] = dict((locale, _text(rand, locale, 3)) for locale in locales)
+                    if additiveIds and rand.random() < 0.7:
+                        dish[u"additives"] = sorted(rand.sample(additiveIds, rand.randint(1, min(4, len(additiveIds)))))
+                    dayDishes.append(dish)
+                dayCounters.append({u"title" : dict((locale, _counterTitle(locale, counterIndex)) for locale in locales),
+                                    u"dishes" : dayDishes})
+            menu.append({u"date" : int(time.mktime(lunchDate.timetuple())) + 12 * 3600,
+                         u"weekDay" : weekDays[lunchDate.weekday()],
+                         u"counters" : dayCounters})
+        lunchDate += datetime.timedelta(days=1)
+
+    return {u"settings" : settings, u"menu" : menu}
+
+def generateJSON(**kwargs):
+    """Returns the payload of generatePayload(**kwargs) as UTF-8 encoded JSON."""
+    return json.dumps(generatePayload(**kwargs), ensure_ascii=False).encode("utf-8")
+
+def addPayloadOptions(parser):
+    parser.add_option("--days", type="int", default=5, help="number of lunch days")
+    parser.add_option("--counters", type="int", default=5, help="counters per day")
+    parser.add_option("--dishes", type="int", default=2, help="dishes per counter")
+    parser.add_option("--locales", default="de,en", help="comma separated locales")
+    parser.add_option("--additives", type="int", default=14, help="number of additives")
+    parser.add_option("--seed", type="int", default=0, help="random seed")
+
+def payloadOptions(options):
+    return dict(days=options.days,
+                counters=options.counters,
+                dishes=options.dishes,
+                locales=tuple(unicode(locale) for locale in options.locales.split(",")),
+                additives=options.additives,
+                seed=options.seed)
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] [output]")
+    addPayloadOptions(parser)
+    options, args = parser.parse_args()
+    body = generateJSON(**payloadOptions(options))
+    if args:
+        with open(args[0], "wb") as outFile:
+            outFile.write(body)
+    else:
+        sys.stdout.write(body)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Runs the lunch menu benchmarks and reports throughput and peak memory.
+
+Usage: python benchmarks/run_benchmarks.py [options] [benchmark ...]
+
+Every benchmark runs in its own process, so the reported peak memory
+(maximum resident set size) belongs to that benchmark alone. The payload
+options of generate_payload.py select the size of the synthetic lunch
+menu; --json prints one JSON object per benchmark for comparing runs.
+The lunchinator package has to be importable; caches and the history are
+written to a temporary directory.
+"""
+import BaseHTTPServer
+import json
+import os
+import resource
+import shutil
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generate_payload import generateJSON, addPayloadOptions, payloadOptions
+
+class PayloadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the payload like Eurest's server. If changingETag is set,
+    every response gets a new ETag, so conditional requests never return
+    304."""
+    protocol_version = "HTTP/1.1"
+    # avoid delayed ACK stalls on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    body = ""
+    changingETag = False
+    requests = 0
+
+    def do_GET(self):
+        PayloadHandler.requests += 1
+        etag = '"%d"' % (PayloadHandler.requests if self.changingETag else 0)
+        if self.headers.getheader("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *_args):
+        pass
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def startServer(body, changingETag):
+    PayloadHandler.body = body
+    PayloadHandler.changingETag = changingETag
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PayloadHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:%d/all.json" % server.server_port
+
+def _localesAndMessages(LunchMenu):
+    return [(localeString, LunchMenu.loadMessagesForLocale(localeString)) for localeString in ("de_DE", "en_US")]
+
+# Every setup function returns (operation, bytes processed per operation or None).
+
+def setupParse(LunchMenu, body, _tempDir):
+    localesAndMessages = _localesAndMessages(LunchMenu)
+    return lambda: LunchMenu.parseLunchMenus(json.loads(body), localesAndMessages), len(body)
+
+def setupStream(LunchMenu, body, _tempDir):
+    localesAndMessages = _localesAndMessages(LunchMenu)
+    return lambda: list(LunchMenu.iterLunchMenus(StringIO(body), localesAndMessages, [{}, {}])), len(body)
+
+def setupReadLunchMenus(LunchMenu, body, _tempDir):
+    _server, url = startServer(body, False)
+    LunchMenu.setURL(url)
+    messages = LunchMenu.loadMessagesForLocale("de_DE")
+    return lambda: LunchMenu.readLunchMenus("de_DE", messages), len(body)
+
+def setupLoadMessages(LunchMenu, _body, _tempDir):
+    return lambda: (LunchMenu.loadMessagesForLocale("de_DE"), LunchMenu.loadMessagesForLocale("en_US")), None
+
+def setupInitialize(LunchMenu, body, _tempDir):
+    _server, url = startServer(body, True)
+    return lambda: LunchMenu.initialize(url), len(body)
+
+def setupInitializeNotModified(LunchMenu, body, _tempDir):
+    _server, url = startServer(body, False)
+    LunchMenu.initialize(url)
+    return lambda: LunchMenu.initialize(url), None
+
+def setupWidget(LunchMenu, body, _tempDir):
+    from PyQt4.QtGui import QApplication
+    from eurest_lunch_menu_gui.lunch_menu_widget import LunchMenuWidget
+    setupWidget.application = QApplication([])
+    _server, url = startServer(body, False)
+    snapshot = LunchMenu.initialize(url)
+
+    def run():
+        widget = LunchMenuWidget(None)
+        widget.updateLunchMenu(snapshot)
+        for pageIndex in range(widget.menuNotebook.count()):
+            widget.buildPage(pageIndex)
+        widget.deleteLater()
+        setupWidget.application.processEvents()
+    return run, None
+
+def setupStatistics(LunchMenu, body, _tempDir):
+    from eurest_lunch_menu_statistics import LunchStatisticsThread
+    from tests.sqlite_statistics_db import SQLiteStatisticsDB
+    _server, url = startServer(body, False)
+    snapshot = LunchMenu.initialize(url)
+    lunchMenus = snapshot.getEnglishMenus()
+    messages = snapshot.getEnglishMessages()
+    forceDates = set(aLunchMenu.lunchDate for aLunchMenu in lunchMenus)
+    statDB = SQLiteStatisticsDB()
+    thread = LunchStatisticsThread(None)
+    return lambda: thread.ingest(statDB, lunchMenus, messages, forceDates), None
+
+benchmarks = [("parse", setupParse),
+              ("stream", setupStream),
+              ("readLunchMenus", setupReadLunchMenus),
+              ("loadMessagesForLocale", setupLoadMessages),
+              ("initialize", setupInitialize),
+              ("initialize-not-modified", setupInitializeNotModified),
+              ("widget", setupWidget),
+              ("statistics", setupStatistics)]
+
+def peakMemoryKB():
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes elsewhere
+    return maxRSS / 1024 if sys.platform == "darwin" else maxRSS
+
+def runBenchmark(name, body, minTime):
+    """Runs a single benchmark in this process and returns its results."""
+    from eurest_lunch_menu import LunchMenu
+    from eurest_lunch_menu.lunch_menu_cache import LunchMenuCache
+    from eurest_lunch_menu.lunch_menu_history import LunchMenuHistory
+
+    tempDir = tempfile.mkdtemp()
+    try:
+        LunchMenu._cache = LunchMenuCache(tempDir)
+        LunchMenu._history = LunchMenuHistory(os.path.join(tempDir, "history.sqlite"))
+        operation, bytesPerOperation = dict(benchmarks)[name](LunchMenu, body, tempDir)
+
+        # warm up
+        operation()
+        iterations = 0
+        start = time.time()
+        elapsed = 0
+        while iterations < 3 or elapsed < minTime:
+            operation()
+            iterations += 1
+            elapsed = time.time() - start
+    finally:
+        shutil.rmtree(tempDir, True)
+
+    result = {"name" : name,
+              "iterations" : iterations,
+              "seconds" : elapsed,
+              "msPerOperation" : 1000. * elapsed / iterations,
+              "operationsPerSecond" : iterations / elapsed,
+              "peakMemoryKB" : peakMemoryKB()}
+    if bytesPerOperation:
+        result["MBPerSecond"] = bytesPerOperation * iterations / elapsed / 1024 / 1024
+    return result
+
+def main():
+    parser = OptionParser(usage="%prog [options] [benchmark ...]\n\nBenchmarks: " + ", ".join(name for name, _setup in benchmarks))
+    addPayloadOptions(parser)
+    parser.add_option("--min-time", type="float", default=1.0, help="minimum seconds per benchmark")
+    parser.add_option("--json", action="store_true", default=False, help="print results as JSON lines")
+    parser.add_option("--single", action="store_true", default=False, help=SUPPRESS_HELP)
+    options, names = parser.parse_args()
+
+    unknown = [name for name in names if name not in dict(benchmarks)]
+    if unknown:
+        parser.error("unknown benchmark(s): %s" % ", ".join(unknown))
+
+    if options.single:
+        body = generateJSON(**payloadOptions(options))
+        print json.dumps(runBenchmark(names[0], body, options.min_time))
+        return
+
+    if not options.json:
+        print "payload: %d days, %d counters, %d dishes, %s, %d bytes" % (options.days, options.counters, options.dishes,
+                                                                         options.locales, len(generateJSON(**payloadOptions(options))))
+        print "%-24s %10s %12s %12s %10s %14s" % ("benchmark", "iterations", "ms/op", "ops/s", "MB/s", "peak RSS (KB)")
+    for name in names or [name for name, _setup in benchmarks]:
+        args = [sys.executable, os.path.abspath(__file__), "--single", name] + [arg for arg in sys.argv[1:] if arg not in dict(benchmarks) and arg != "--json"]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        if process.returncode != 0:
+            lastLine = err.strip().splitlines()[-1] if err.strip() else "exit code %d" % process.returncode
+            if options.json:
+                print json.dumps({"name" : name, "error" : lastLine})
+            else:
+                print "%-24s skipped: %s" % (name, lastLine)
+            continue
+        result = json.loads(out.strip().splitlines()[-1])
+        if options.json:
+            print json.dumps(result)
+        else:
+            print "%-24s %10d %12.3f %12.1f %10s %14d" % (name,
+                                                          result["iterations"],
+                                                          result["msPerOperation"],
+                                                          result["operationsPerSecond"],
+                                                          "%.1f" % result["MBPerSecond"] if "MBPerSecond" in result else "-",
+                                                          result["peakMemoryKB"])
+
+if __name__ == "__main__":
+    main()
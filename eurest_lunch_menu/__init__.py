@@ -1,28 +1,48 @@
 # -*- coding: utf-8 -*-
-from StringIO import StringIO
 import locale
-import time
 import datetime
-import inspect
 import csv
-import calendar
 import re
-import sys
 import os
-import urllib2
-from lunchinator import log_debug, log_exception
-import codecs
-import contextlib
-import json
+from lunchinator import log_debug, log_exception, log_warning, get_settings
+from eurest_lunch_menu.lunch_menu_refresher import LunchMenuRefresher
+from eurest_lunch_menu.lunch_menu_snapshot import LunchMenuSnapshot, LunchMenuCanteen
+from eurest_lunch_menu.lunch_menu_single_flight import SingleFlight
+from eurest_lunch_menu.lunch_menu_classifier import CounterClassifier
+from eurest_lunch_menu.lunch_menu_dish import LunchDish, internString
+from eurest_lunch_menu.lunch_menu_additive_index import AdditiveIndex
+from eurest_lunch_menu.lunch_menu_date_index import LunchMenuDateIndex
+from eurest_lunch_menu.lunch_menu_html import renderLunchMenu, formatTitleAndDescription
+from eurest_lunch_menu.lunch_menu_date_format import formatDate
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+import threading
+
+# The HTTP client, cache, history (sqlite3), JSON parsing and thread pool
+# are imported when they are used first, which keeps importing this module
+# cheap for plugin discovery and the CLI.
+
+_moduleFolder = os.path.dirname(os.path.abspath(__file__))
 
 class LunchMenu (object):    
     def __init__(self):
         self.lunchDate = None
         self.contents = {}
+        self._fingerprint = None
     
     def isValid(self):
         return self.lunchDate != None and self.contents != None and len(self.contents) > 0
     
+    def fingerprint(self):
+        """Returns a hash of the date and contents, equal for days with
+        identical lunch menus. Must not be called before the lunch menu is
+        complete; it is computed once."""
+        if self._fingerprint == None:
+            import hashlib
+            contents = tuple(sorted((category, tuple(tuple(dish) for dish in dishes))
+                                    for category, dishes in self.contents.iteritems()))
+            self._fingerprint = hashlib.sha1(repr((self.lunchDate, contents))).hexdigest()
+        return self._fingerprint
+    
     def __str__(self):
         return "%s" % (self.contents)
     
@@ -31,127 +51,743 @@ class LunchMenu (object):
     fallbackLocale = "en_US"
     defaultLocaleString = None
     
-    _url = None
-    _messages = None
-    _toggleMessages = None
+    # URLs of all canteens, the first one is the primary canteen
+    _urls = ()
+    _cache = None
+    _httpClient = None
+    _history = None
+    _historyLock = threading.Lock()
+    
+    # seconds until a single download is aborted
+    httpTimeout = 30
+    maxConcurrentFetches = 8
+    
+    # the published LunchMenuSnapshot, replaced as a whole on every update
+    _snapshot = None
+    
+    # seconds after which the lunch menu is refreshed
+    refreshInterval = 60*60
     
-    _lunchMenus = None
-    _toggleLunchMenus= None
-    _allLunchMenus = None
+    _refresher = None
+    _refresherUsers = 0
+    _oneShotRefresh = None
+    _refresherLock = threading.Lock()
     
-    _additives = None
-    _toggleAdditives = None
+    _updateListeners = []
+    _updateListenersLock = threading.Lock()
     
-    _lastUpdate = None
+    _publishLock = threading.Lock()
+    
+    # CounterClassifier per message catalog
+    _classifiers = {}
+    # path : (mtime, messages) of the loaded message catalogs
+    _messageCatalogs = {}
+    
+    # the LunchMenuServer serving this instance's lunch menus, or None
+    _server = None
+    _serverLock = threading.Lock()
+    _servedDayPattern = re.compile(u"^/menus/(\\d{4}-\\d{2}-\\d{2})/(de|en)\\.json$")
+    _singleFlight = SingleFlight()
+    
+    @classmethod
+    def secondsUntilOutdated(cls):
+        snapshot = cls._snapshot
+        if snapshot == None or snapshot.lastUpdate == None or snapshot.urls != cls._urls:
+            return 0
+        td = datetime.datetime.now() - snapshot.lastUpdate
+        return cls.refreshInterval - (td.seconds + td.days * 24 * 3600)
+    
+    @classmethod
+    def isOutdated(cls):
+        return cls.secondsUntilOutdated() <= 0
     
     @classmethod
     def _checkOutdated(cls):
-        now = datetime.datetime.now()
-        td = now - cls._lastUpdate
-        difference = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
-        if cls._lastUpdate == None or difference > 60*60:
-            cls.initialize()
+        if cls._snapshot == None:
+            # nothing loaded yet, reading the cache does not block on the network
+            cls.initializeFromCache()
+        if cls.isOutdated():
+            cls.requestRefresh()
     
     @classmethod
-    def lunchMenus(cls):
+    def requestRefresh(cls):
+        """Refreshes the lunch menu in the background, returns immediately."""
+        with cls._refresherLock:
+            if cls._refresher != None:
+                if not cls._singleFlight.isRunning(cls._urls):
+                    cls._refresher.refreshNow()
+            elif cls._oneShotRefresh == None or not cls._oneShotRefresh.is_alive():
+                cls._oneShotRefresh = threading.Thread(target=cls.initialize, name="LunchMenuRefresh")
+                cls._oneShotRefresh.daemon = True
+                cls._oneShotRefresh.start()
+    
+    @classmethod
+    def startRefresher(cls, url=None):
+        """Starts refreshing the lunch menu regularly in the background.
+        Every call has to be matched by a call to stopRefresher."""
+        urls = cls.splitURLs(url)
+        urlChanged = urls and urls != cls._urls
+        if urls:
+            cls._urls = urls
+        with cls._refresherLock:
+            cls._refresherUsers += 1
+            refresherRunning = cls._refresher != None
+            if not refresherRunning:
+                # a new refresher refreshes right away if the menu is outdated
+                cls._refresher = LunchMenuRefresher(cls.initialize, cls.secondsUntilOutdated)
+                cls._refresher.start()
+        if urlChanged and refresherRunning:
+            cls.requestRefresh()
+    
+    @classmethod
+    def stopRefresher(cls):
+        with cls._refresherLock:
+            cls._refresherUsers -= 1
+            if cls._refresherUsers <= 0 and cls._refresher != None:
+                cls._refresherUsers = 0
+                cls._refresher.stop()
+                cls._refresher = None
+    
+    @classmethod
+    def splitURLs(cls, url):
+        """Returns a tuple of the URLs in url, separated by whitespace, commas or semicolons."""
+        if not url:
+            return ()
+        return tuple(aURL for aURL in re.split(u"[\\s,;]+", url) if aURL)
+    
+    @classmethod
+    def setURL(cls, url):
+        """Sets the URL of the lunch menu; url may contain the URLs of several canteens."""
+        cls._urls = cls.splitURLs(url)
+    
+    @classmethod
+    def addUpdateListener(cls, listener):
+        """listener is called with the new LunchMenuSnapshot from the
+        refreshing thread whenever new lunch menus are published."""
+        with cls._updateListenersLock:
+            cls._updateListeners = cls._updateListeners + [listener]
+    
+    @classmethod
+    def removeUpdateListener(cls, listener):
+        with cls._updateListenersLock:
+            cls._updateListeners = [aListener for aListener in cls._updateListeners if aListener != listener]
+    
+    @classmethod
+    def _publish(cls, snapshot, notify=True):
+        """Publishes snapshot, returns False if it was discarded.
+        
+        The snapshot is discarded if the URLs have changed in the meantime.
+        Snapshots without lunch menus or with cached lunch menus never
+        replace downloaded lunch menus of the same URLs."""
+        with cls._publishLock:
+            if snapshot.urls != cls._urls:
+                return False
+            current = cls._snapshot
+            if current != None and current.urls == snapshot.urls and current.isInitialized():
+                if not snapshot.isInitialized():
+                    return False
+                if snapshot.lastUpdate == None and current.lastUpdate != None:
+                    return False
+            cls._snapshot = snapshot
+        
+        if notify:
+            for listener in cls._updateListeners:
+                try:
+                    listener(snapshot)
+                except:
+                    log_exception(u"Error notifying lunch menu listener")
+        return True
+    
+    @classmethod
+    def snapshot(cls):
+        """Returns the current LunchMenuSnapshot without waiting for a refresh.
+        Take one snapshot and use it for all reads that belong together.
+        
+        Never returns None: if nothing is published, e.g. because the URLs
+        changed while the cache was read, an uninitialized snapshot of the
+        current URLs is returned."""
         cls._checkOutdated()
-        return cls._lunchMenus
+        snapshot = cls._snapshot
+        if snapshot == None:
+            snapshot = cls._createSnapshot(cls._urls)
+        return snapshot
+    
+    @classmethod
+    def isInitialized(cls):
+        snapshot = cls._snapshot
+        return snapshot != None and snapshot.isInitialized()
+    
+    @classmethod
+    def lunchMenus(cls):
+        return cls.snapshot().lunchMenus
     
     @classmethod
     def toggleLunchMenus(cls):
-        cls._checkOutdated()
-        return cls._toggleLunchMenus
+        return cls.snapshot().toggleLunchMenus
     
     @classmethod
     def allLunchMenus(cls):
-        cls._checkOutdated()
-        return cls._allLunchMenus
+        return cls.snapshot().allLunchMenus
 
     @classmethod
     def messages(cls):
-        cls._checkOutdated()
-        return cls._messages
+        return cls.snapshot().messages
     
     @classmethod
     def toggleMessages(cls):
-        cls._checkOutdated()
-        return cls._toggleMessages
+        return cls.snapshot().toggleMessages
     
     @classmethod
     def additives(cls):
-        return cls._additives
+        return cls.snapshot().additives
     
     @classmethod
     def toggleAdditives(cls):
-        return cls._toggleAdditives
+        return cls.snapshot().toggleAdditives
     
     @classmethod
     def getEnglishMenus(cls):
-        return cls.lunchMenus() if "en" in cls.defaultLocaleString else cls.toggleLunchMenus()
+        return cls.snapshot().getEnglishMenus()
     
     @classmethod
     def getGermanMenus(cls):
-        return cls.lunchMenus() if "de" in cls.defaultLocaleString else cls.toggleLunchMenus()
+        return cls.snapshot().getGermanMenus()
     
     @classmethod
     def getEnglishMessages(cls):
-        return cls.messages() if "en" in cls.defaultLocaleString else cls.toggleMessages()
+        return cls.snapshot().getEnglishMessages()
     
     @classmethod
     def getGermanMessages(cls):
-        return cls.messages() if "de" in cls.defaultLocaleString else cls.toggleMessages()
+        return cls.snapshot().getGermanMessages()
 
     @classmethod
     def getEnglishWeekdays(cls):
-        cls._checkOutdated()
-        englishMessages = cls.getEnglishMessages()
-        return [englishMessages['monday'], englishMessages['tuesday'], englishMessages['wednesday'], englishMessages['thursday'], englishMessages['friday']]
+        return cls.snapshot().getEnglishWeekdays()
 
     @classmethod
     def getMessages(cls, localeString):
-        return cls.getGermanMessages() if "de" in localeString else cls.getEnglishMessages()
+        return cls.snapshot().getMessages(localeString)
 
     @classmethod
     def getLunchMenu(cls, weekday, localeString):
-        weekday = weekday % 7
-        if weekday > 4:
-            return None
-        menus = cls.getGermanMenus() if "de" in localeString else cls.getEnglishMenus()
-        return menus[weekday]
+        """Returns the lunch menu of the given weekday (0 = Monday) of the
+        current week; larger values refer to the following weeks."""
+        today = cls.today()
+        return cls.getLunchMenuForDate(today + datetime.timedelta(days=weekday - today.weekday()), localeString)
+    
+    @classmethod
+    def getDateIndex(cls, localeString, snapshot=None, canteen=None, historyWeeks=0):
+        """Returns the LunchMenuDateIndex over the lunch menus of snapshot
+        (default: the current one) in the given language, built once per
+        snapshot. If historyWeeks > 0, the given number of weeks before the
+        current one are added from the history."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if canteen == None:
+            canteen = snapshot.primaryCanteen()
+        # the weeks read from the history move with the current day
+        today = cls.today() if historyWeeks > 0 else None
+        
+        def createIndex():
+            lunchMenus = [aLunchMenu for aLunchMenu in (snapshot.getMenus(localeString, canteen) if canteen != None else None) or ()
+                          if type(aLunchMenu) == LunchMenu]
+            if historyWeeks > 0 and canteen != None and canteen.url != None:
+                startDate = today - datetime.timedelta(days=today.weekday() + 7 * historyWeeks)
+                endDate = lunchMenus[0].lunchDate - datetime.timedelta(days=1) if lunchMenus else today
+                lunchMenus = cls._readHistory(startDate, endDate, localeString, snapshot, canteen, ()) + lunchMenus
+            return LunchMenuDateIndex(lunchMenus)
+        
+        return snapshot.cached(u"dateIndex",
+                               ("de" if "de" in localeString else "en", canteen.url if canteen != None else None, historyWeeks, today),
+                               createIndex)
         
     @classmethod
-    def initialize(cls, url=None):
-        if url:
-            cls._url = url
+    def getAdditiveIndex(cls, localeString, snapshot=None, canteen=None):
+        """Returns the AdditiveIndex over the lunch menus of snapshot (default:
+        the current one) in the given language, built once per snapshot."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if canteen == None:
+            canteen = snapshot.primaryCanteen()
+        
+        def createIndex():
+            index = AdditiveIndex(snapshot.getAdditives(localeString, canteen) if canteen != None else None)
+            if canteen != None:
+                for aLunchMenu in snapshot.getMenus(localeString, canteen) or ():
+                    if type(aLunchMenu) == LunchMenu:
+                        index.addLunchMenu(aLunchMenu)
+            return index
+        
+        return snapshot.cached(u"additiveIndex", ("de" if "de" in localeString else "en", canteen.url if canteen != None else None), createIndex)
+    
+    @classmethod
+    def findDishesWithout(cls, additiveIds, localeString, dates=None, snapshot=None):
+        """Returns the IndexedDish entries of the lunch menus of snapshot
+        (default: the current one) that contain none of the given additives.
+        
+        If dates is given, only these dates are searched; dates that are not
+        in the snapshot are read from the history into a copy of the shared
+        index, which is cached per snapshot and range of missing dates."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        canteen = snapshot.primaryCanteen()
+        index = cls.getAdditiveIndex(localeString, snapshot, canteen)
+        if dates != None and canteen != None and canteen.url != None:
+            missing = [aDate for aDate in dates if not index.covers(aDate)]
+            if missing:
+                sharedIndex = index
+                
+                def createIndex():
+                    extendedIndex = sharedIndex.copy()
+                    for aLunchMenu in cls._readHistory(min(missing), max(missing), localeString, snapshot, canteen, ()):
+                        if not extendedIndex.covers(aLunchMenu.lunchDate):
+                            extendedIndex.addLunchMenu(aLunchMenu)
+                    extendedIndex.cover(missing)
+                    return extendedIndex
+                
+                index = snapshot.cached(u"additiveHistoryIndex",
+                                        ("de" if "de" in localeString else "en", canteen.url, min(missing), max(missing)),
+                                        createIndex)
+        return index.dishesWithout(additiveIds, dates)
+    
+    @classmethod
+    def getHistory(cls):
+        """Returns the LunchMenuHistory containing all lunch menus ever read."""
+        with cls._historyLock:
+            if cls._history == None:
+                from eurest_lunch_menu.lunch_menu_history import LunchMenuHistory
+                cls._history = LunchMenuHistory(os.path.join(get_settings().get_config(u"eurest_lunch_menu"), "history.sqlite"))
+            return cls._history
+    
+    @classmethod
+    def _categoryKeys(cls, messages):
+        """Returns {displayed category : key base} of the message catalog."""
+        return dict((messages[keyBase + u"Displayed"], keyBase) for keyBase in CounterClassifier.keyBases)
+    
+    @classmethod
+    def _storeHistory(cls, snapshot, canteens):
         try:
-            cls.defaultLocaleString = locale.getdefaultlocale()[0]
-            if not cls.defaultLocaleString in cls.supportedLocales:
-                cls.defaultLocaleString = cls.fallbackLocale
+            history = cls.getHistory()
+            with metrics.timer(u"history.store"):
+                for canteen in canteens:
+                    for localeString, messages, menus, additives in ((snapshot.defaultLocaleString, snapshot.messages, canteen.lunchMenus, canteen.additives),
+                                                                     (snapshot.messages['toggleLocale'], snapshot.toggleMessages, canteen.toggleLunchMenus, canteen.toggleAdditives)):
+                        history.storeDays(canteen.url,
+                                          localeString,
+                                          [aLunchMenu for aLunchMenu in menus if type(aLunchMenu) == LunchMenu],
+                                          cls._categoryKeys(messages),
+                                          additives)
         except:
-            cls.defaultLocaleString = cls.fallbackLocale
+            log_exception(u"Error writing lunch menu history")
+    
+    @classmethod
+    def _readHistory(cls, startDate, endDate, localeString, snapshot, canteen, skipDates):
+        """Returns the stored lunch menus from startDate to endDate that are
+        not in skipDates, sorted by date."""
+        messages = snapshot.getMessages(localeString)
+        history = cls.getHistory()
+        historyMenus = {}
+        for aDate in history.dates(canteen.url, localeString, startDate, endDate):
+            if aDate not in skipDates:
+                aLunchMenu = LunchMenu()
+                aLunchMenu.lunchDate = aDate
+                historyMenus[aDate] = aLunchMenu
+        if historyMenus:
+            for aDate, category, title, description, keyInfo, additives in history.dishRows(canteen.url, localeString, startDate, endDate):
+                if aDate in historyMenus:
+                    displayedKey = messages.get(category + u"Displayed", category)
+                    cls.addListMenuContent(historyMenus[aDate],
+                                           displayedKey,
+                                           LunchDish.create(title, description, additives, keyInfo))
+        return [historyMenus[aDate] for aDate in sorted(historyMenus)]
+    
+    @classmethod
+    def getLunchMenusBetween(cls, startDate, endDate, localeString, snapshot=None, canteen=None):
+        """Returns the lunch menus from startDate to endDate (inclusive), sorted by date.
         
-        cls._messages = cls.loadMessagesForLocale(cls.defaultLocaleString)
-        cls._toggleMessages = cls.loadMessagesForLocale(cls._messages["toggleLocale"])
+        Days contained in the snapshot (default: the current one) are taken
+        from it, older days are read from the history without accessing
+        the network."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if canteen == None:
+            canteen = snapshot.primaryCanteen()
         
+        lunchMenus = cls.getDateIndex(localeString, snapshot, canteen).between(startDate, endDate)
+        if canteen != None and canteen.url != None and len(lunchMenus) < (endDate - startDate).days + 1:
+            lunchMenus = sorted(lunchMenus + cls._readHistory(startDate, endDate, localeString, snapshot, canteen,
+                                                              set(aLunchMenu.lunchDate for aLunchMenu in lunchMenus)),
+                                key=lambda aLunchMenu: aLunchMenu.lunchDate)
+        return lunchMenus
+    
+    @classmethod
+    def getLunchMenuForDate(cls, aDate, localeString, snapshot=None, canteen=None):
+        """Returns the lunch menu of aDate, None if there is no lunch on that
+        day, or the exception that prevented loading the lunch menus."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if canteen == None:
+            canteen = snapshot.primaryCanteen()
+        aLunchMenu = cls.getDateIndex(localeString, snapshot, canteen).get(aDate)
+        if aLunchMenu != None:
+            return aLunchMenu
+        lunchMenus = cls.getLunchMenusBetween(aDate, aDate, localeString, snapshot, canteen)
+        if lunchMenus:
+            return lunchMenus[0]
+        return snapshot.getError(canteen)
+    
+    @classmethod
+    def getLunchMenusForWeek(cls, aDate, localeString, snapshot=None, canteen=None):
+        """Returns the lunch menus of the week (Monday to Sunday) containing aDate."""
+        monday = aDate - datetime.timedelta(days=aDate.weekday())
+        return cls.getLunchMenusBetween(monday, monday + datetime.timedelta(days=6), localeString, snapshot, canteen)
+    
+    @classmethod
+    def formatDate(cls, aDate, localeString, snapshot=None):
+        """Returns aDate formatted with the dateFormatDisplayed of the
+        language, computed once per snapshot. Day and month names are taken
+        from the message catalog, the process locale is never changed."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        messages = snapshot.getMessages(localeString)
+        return snapshot.cached(u"date", ("de" if "de" in localeString else "en", aDate),
+                               lambda: formatDate(aDate, messages[u"dateFormatDisplayed"], messages))
+    
+    @classmethod
+    def getLunchMenuHTML(cls, aDate, localeString, snapshot=None, canteen=None):
+        """Returns the HTML fragment of the lunch menu of aDate, rendered
+        once per snapshot, or None if there is no lunch menu for that day.
+        Additives are anchors with the additive text as title."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if canteen == None:
+            canteen = snapshot.primaryCanteen()
+        
+        def createHTML():
+            aLunchMenu = cls.getLunchMenuForDate(aDate, localeString, snapshot, canteen)
+            if type(aLunchMenu) != LunchMenu:
+                return None
+            return renderLunchMenu(aLunchMenu,
+                                   snapshot.getMessages(localeString),
+                                   snapshot.getAdditives(localeString, canteen) if canteen != None else {},
+                                   cls.formatDate(aLunchMenu.lunchDate, localeString, snapshot))
+        
+        return snapshot.cached(u"html", ("de" if "de" in localeString else "en", canteen.url if canteen != None else None, aDate), createHTML)
+    
+    @classmethod
+    def searchDishes(cls, query, localeString=None, startDate=None, endDate=None, snapshot=None):
+        """Searches the history for dishes matching every word of query as
+        a prefix, ignoring case and accents.
+        
+        Returns (canteen URL, date, locale, displayed category, dish) tuples,
+        newest first. Without localeString, both languages are searched."""
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        result = []
+        for canteen, aDate, localeKey, category, title, description, keyInfo, additives in cls.getHistory().search(query, localeString, startDate, endDate):
+            messages = snapshot.getMessages(localeKey)
+            result.append((canteen,
+                           aDate,
+                           localeKey,
+                           messages.get(category + u"Displayed", category),
+                           LunchDish.create(title, description, additives, keyInfo)))
+        return result
+    
+    @classmethod
+    def iterExportedLunchMenus(cls, startDate, endDate, localeStrings, exportFormat, snapshot=None):
+        """Yields the lunch menus of all loaded canteens from startDate to
+        endDate (inclusive) in exportFormat ("json", "csv" or "ics", see
+        lunch_menu_export) as UTF-8 encoded parts: the header, one part per
+        day and language, and the footer.
+        
+        Days are ordered by canteen, date and the order of localeStrings.
+        Every day is serialized once per snapshot and the days of a range
+        are looked up once, older days are read from the history without
+        accessing the network."""
+        from eurest_lunch_menu.lunch_menu_export import exportHeader, exportFooter, exportLunchMenu
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        localeKeys = tuple("de" if "de" in localeString else "en" for localeString in localeStrings)
+        timestamp = datetime.datetime.utcnow()
+        
+        yield exportHeader(exportFormat)
+        for canteen in snapshot.canteens:
+            if not canteen.loaded:
+                continue
+            days = snapshot.cached(u"exportDays", (localeKeys, canteen.url, startDate, endDate),
+                                   lambda: sorted((aLunchMenu.lunchDate, i, localeKey, aLunchMenu)
+                                                  for i, localeKey in enumerate(localeKeys)
+                                                  for aLunchMenu in cls.getLunchMenusBetween(startDate, endDate, localeKey, snapshot, canteen)))
+            for aDate, _i, localeKey, aLunchMenu in days:
+                yield snapshot.cached(u"export", (exportFormat, localeKey, canteen.url, aDate),
+                                      lambda: exportLunchMenu(exportFormat,
+                                                              aLunchMenu,
+                                                              localeKey,
+                                                              snapshot.getMessages(localeKey),
+                                                              snapshot.getAdditives(localeKey, canteen),
+                                                              canteen.url,
+                                                              cls.formatDate(aDate, localeKey, snapshot),
+                                                              timestamp))
+        yield exportFooter(exportFormat)
+    
+    @classmethod
+    def exportLunchMenus(cls, startDate, endDate, localeStrings, exportFormat, snapshot=None):
+        """Returns the parts of iterExportedLunchMenus joined to one UTF-8
+        encoded text."""
+        return "".join(cls.iterExportedLunchMenus(startDate, endDate, localeStrings, exportFormat, snapshot))
+    
+    @classmethod
+    def startServer(cls, port):
+        """Serves the lunch menus of this instance on port (all interfaces),
+        see getServedResource. Replaces a running server; port 0 only
+        stops it."""
+        from eurest_lunch_menu.lunch_menu_server import LunchMenuServer
+        with cls._serverLock:
+            if cls._server != None:
+                cls._server.stop()
+                cls._server = None
+            if port:
+                cls._server = LunchMenuServer(port, cls.getServedResource)
+                cls._server.start()
+    
+    @classmethod
+    def stopServer(cls):
+        cls.startServer(0)
+    
+    @classmethod
+    def _servedDates(cls, snapshot, localeKey):
+        """Returns the frozenset of dates with lunch menus of any loaded
+        canteen in the snapshot or the history, read once per snapshot."""
+        def createDates():
+            dates = set()
+            for canteen in snapshot.canteens:
+                if canteen.loaded:
+                    dates.update(cls.getDateIndex(localeKey, snapshot, canteen).dates())
+                    if canteen.url != None:
+                        dates.update(cls.getHistory().dates(canteen.url, localeKey))
+            return frozenset(dates)
+        return snapshot.cached(u"servedDates", localeKey, createDates)
+    
+    @classmethod
+    def getServedResource(cls, path, snapshot=None):
+        """Returns the ServedResource of path, serialized and compressed
+        once per snapshot (default: the current one), or None if path does
+        not exist. Days without a lunch menu in the snapshot or the history
+        do not exist; they are looked up in the dates read once per
+        snapshot, so requesting them never queries the history.
+        
+        /all.json -- the feed of the primary canteen as read from Eurest,
+                     so other instances can use this one as their URL
+        /menus/<YYYY-MM-DD>/<de|en>.json -- the lunch menus of a day as
+                     JSON lines, see exportLunchMenus
+        """
+        from eurest_lunch_menu.lunch_menu_server import ServedResource, ResourceUnavailable
+        if snapshot == None:
+            snapshot = cls.snapshot()
+        if not snapshot.isInitialized():
+            raise ResourceUnavailable()
+        
+        def createResource():
+            if path == u"/all.json":
+                canteen = snapshot.primaryCanteen()
+                cachedResponse = cls.getCache().load(canteen.url) if canteen.loaded else None
+                if cachedResponse == None:
+                    raise ResourceUnavailable()
+                return ServedResource.create(cachedResponse[0], "application/json")
+            match = cls._servedDayPattern.match(path)
+            if match == None:
+                return None
+            try:
+                aDate = datetime.datetime.strptime(match.group(1), "%Y-%m-%d").date()
+            except ValueError:
+                # e.g. 2020-13-45
+                return None
+            localeKey = match.group(2)
+            if aDate not in cls._servedDates(snapshot, localeKey):
+                # not cached, unknown days must not fill the caches
+                return None
+            return ServedResource.create(cls.exportLunchMenus(aDate, aDate, [localeKey], u"json", snapshot),
+                                         "application/json; charset=utf-8")
+        
+        return snapshot.cached(u"served", path, createResource)
+    
+    @classmethod
+    def getCache(cls):
+        if cls._cache == None:
+            from eurest_lunch_menu.lunch_menu_cache import LunchMenuCache
+            cls._cache = LunchMenuCache(get_settings().get_config(u"eurest_lunch_menu"))
+        return cls._cache
+    
+    @classmethod
+    def getHTTPClient(cls):
+        if cls._httpClient == None:
+            from eurest_lunch_menu.lunch_menu_http import LunchMenuHTTPClient
+            cls._httpClient = LunchMenuHTTPClient(cls.httpTimeout)
+        return cls._httpClient
+    
+    @classmethod
+    def _createSnapshot(cls, urls, previous=None):
+        """Returns a snapshot with freshly loaded messages, taking the
+        canteens from the previous snapshot."""
         try:
-            cls._lunchMenus, cls._additives = cls.readLunchMenus(cls.defaultLocaleString, cls._messages)
-        except Exception as e:
-            log_exception(u"Error reading lunch menus")
-            cls._lunchMenus = []
-            for _ in range(5):
-                cls._lunchMenus.append(e)
-            pass
+            defaultLocaleString = locale.getdefaultlocale()[0]
+            if not defaultLocaleString in cls.supportedLocales:
+                defaultLocaleString = cls.fallbackLocale
+        except:
+            defaultLocaleString = cls.fallbackLocale
+        cls.defaultLocaleString = defaultLocaleString
         
+        messages = cls.loadMessagesForLocale(defaultLocaleString)
+        toggleMessages = cls.loadMessagesForLocale(messages["toggleLocale"])
+        canteens = previous.canteens if previous != None else ()
+        return LunchMenuSnapshot(urls, defaultLocaleString, messages, toggleMessages, canteens, None)
+    
+    @classmethod
+    def _parseCanteen(cls, snapshot, url, lunchObj):
+        (lunchMenus, additives), (toggleLunchMenus, toggleAdditives) = \
+            cls.parseLunchMenus(lunchObj, ((snapshot.defaultLocaleString, snapshot.messages),
+                                           (snapshot.messages['toggleLocale'], snapshot.toggleMessages)))
+        return LunchMenuCanteen(url, tuple(lunchMenus), tuple(toggleLunchMenus), additives, toggleAdditives, True)
+    
+    @classmethod
+    def _errorCanteen(cls, url, e):
+        return LunchMenuCanteen(url, (e,), (e,), {}, {}, False)
+    
+    @classmethod
+    def _readCachedCanteen(cls, snapshot, url):
+        """Returns a LunchMenuCanteen with the cached lunch menus or None."""
+        cached = cls.getCache().load(url)
+        metrics.cacheHit(u"disk", cached != None)
+        if cached == None:
+            return None
         try:
-            cls._toggleLunchMenus, cls._toggleAdditives = cls.readLunchMenus(cls._messages['toggleLocale'], cls._toggleMessages)
-        except Exception as e:
-            cls._toggleLunchMenus = []
-            for _ in range(5):
-                cls._toggleLunchMenus.append(e)
-            pass
+            return cls._parseCanteen(snapshot, url, cls.decodeLunchJSON(cached[0]))
+        except:
+            log_exception(u"Error reading cached lunch menus")
+            return None
+    
+    @classmethod
+    def _loadedCanteens(cls, snapshot):
+        """Returns {url : canteen} for the canteens of snapshot that have
+        lunch menus, reading missing ones from the cache."""
+        canteens = dict((canteen.url, canteen) for canteen in snapshot.canteens if canteen.loaded and canteen.url in snapshot.urls)
+        for url in snapshot.urls:
+            if url not in canteens:
+                cachedCanteen = cls._readCachedCanteen(snapshot, url)
+                if cachedCanteen != None:
+                    canteens[url] = cachedCanteen
+        return canteens
+    
+    @classmethod
+    def _withCanteens(cls, snapshot, canteens):
+        """Orders canteens ({url : canteen}) by URL, returns None if the primary canteen is missing."""
+        if snapshot.urls[0] not in canteens:
+            return None
+        return snapshot._replace(canteens=tuple(canteens[url] if url in canteens else LunchMenuCanteen(url, None, None, {}, {}, False)
+                                                for url in snapshot.urls))
+    
+    @classmethod
+    def initializeFromCache(cls, url=None):
+        """Loads the last good responses from disk without touching the network.
+        Returns True if cached lunch menus are available.
+        
+        Lunch menus that are already loaded are never replaced by the cache."""
+        urls = cls.splitURLs(url)
+        if urls:
+            cls._urls = urls
+        urls = cls._urls
+        return cls._singleFlight.do((u"cache", urls), cls._initializeFromCache, urls)
+    
+    @classmethod
+    def _initializeFromCache(cls, urls):
+        snapshot = cls._createSnapshot(urls)
+        if not urls:
+            cls._publish(snapshot._replace(canteens=(cls._errorCanteen(None, Exception(snapshot.messages[u"checkURL"])),)))
+            return False
+        
+        cachedSnapshot = cls._withCanteens(snapshot, cls._loadedCanteens(snapshot))
+        if cachedSnapshot == None:
+            cls._publish(snapshot._replace(canteens=()), notify=False)
+            return False
+        return cls._publish(cachedSnapshot)
+        
+    @classmethod
+    def initialize(cls, url=None):
+        """Refreshes the lunch menus of all canteens and returns the published snapshot.
+        
+        The canteens are downloaded concurrently. Concurrent calls for the
+        same URLs are coalesced: all callers wait for, and receive the
+        result of, a single refresh.
+        """
+        urls = cls.splitURLs(url)
+        if urls:
+            cls._urls = urls
+        urls = cls._urls
+        return cls._singleFlight.do(urls, cls._initialize, urls)
+    
+    @classmethod
+    def _initialize(cls, urls):
+        with metrics.timer(u"refresh"):
+            snapshot = cls._createSnapshot(urls, cls._snapshot)
+            
+            if not urls:
+                cls._publish(snapshot._replace(canteens=(cls._errorCanteen(None, Exception(snapshot.messages[u"checkURL"])),),
+                                               lastUpdate=datetime.datetime.now()))
+                return cls._snapshot
+            
+            canteens = cls._loadedCanteens(snapshot)
+            if any(canteen not in snapshot.canteens for canteen in canteens.values()):
+                # offline first: show the cached menus until the download finishes
+                cachedSnapshot = cls._withCanteens(snapshot, canteens)
+                if cachedSnapshot != None:
+                    cls._publish(cachedSnapshot)
+            
+            if len(urls) == 1:
+                results = [cls._refreshCanteen(snapshot, urls[0], canteens.get(urls[0]))]
+            else:
+                from multiprocessing.pool import ThreadPool
+                pool = ThreadPool(min(len(urls), cls.maxConcurrentFetches))
+                try:
+                    results = pool.map(lambda url: cls._refreshCanteen(snapshot, url, canteens.get(url)), urls)
+                finally:
+                    pool.close()
+            
+            changedCanteens = []
+            for url, (canteen, canteenChanged) in zip(urls, results):
+                canteens[url] = canteen
+                if canteenChanged:
+                    changedCanteens.append(canteen)
+            
+            snapshot = cls._withCanteens(snapshot, canteens)
+            if snapshot.hasSameData(cls._snapshot):
+                # nothing changed, keep what was derived from the lunch menus
+                snapshot = cls._snapshot
+            snapshot = snapshot._replace(lastUpdate=datetime.datetime.now())
+            cls._publish(snapshot, notify=len(changedCanteens) > 0)
+            cls._storeHistory(snapshot, [canteen for canteen in changedCanteens if canteen.loaded])
+            return cls._snapshot
+    
+    @classmethod
+    def _refreshCanteen(cls, snapshot, url, canteen):
+        """Downloads the lunch menu of a single canteen.
         
-        cls._allLunchMenus = cls._lunchMenus + cls._toggleLunchMenus
-        cls._lastUpdate = datetime.datetime.now()
+        canteen is the currently loaded LunchMenuCanteen of url or None.
+        Returns a tuple (canteen, changed)."""
+        try:
+            response = cls.fetchLunchJSON(url, canteen != None)
+            if response == None:
+                return canteen, False
+            lunchJSON, etag, lastModified = response
+            newCanteen = cls._parseCanteen(snapshot, url, cls.decodeLunchJSON(lunchJSON))
+            cls.getCache().store(url, lunchJSON, etag, lastModified)
+            return newCanteen, True
+        except Exception as e:
+            if canteen != None:
+                log_warning(u"Error updating lunch menu from %s, keeping cached version: %s" % (url, e))
+                return canteen, False
+            log_exception(u"Error reading lunch menu from %s" % url)
+            return cls._errorCanteen(url, e), True
     
     @classmethod
     def today(cls):
@@ -168,12 +804,29 @@ class LunchMenu (object):
     
     @classmethod
     def loadMessagesForLocale(cls, localeString):
-        moduleFolder = os.path.realpath(os.path.abspath(os.path.join(os.path.split(inspect.getfile( inspect.currentframe() ))[0])))
-        currentLocalePath = "%s/lunch_menu_strings_%s.tsv" % (moduleFolder, localeString)
-        if (os.path.isfile(currentLocalePath)):
-            return cls.loadMessages(currentLocalePath)
-        else:
-            return cls.loadMessages("%s/lunch_menu_strings.tsv" % (moduleFolder))
+        """Returns the message catalog of the locale. Catalogs are parsed
+        once and cached until their file changes; the returned dict is
+        shared and must not be modified."""
+        currentLocalePath = "%s/lunch_menu_strings_%s.tsv" % (_moduleFolder, localeString)
+        try:
+            mtime = os.stat(currentLocalePath).st_mtime
+        except OSError:
+            currentLocalePath = "%s/lunch_menu_strings.tsv" % (_moduleFolder)
+            mtime = os.stat(currentLocalePath).st_mtime
+        
+        cached = cls._messageCatalogs.get(currentLocalePath)
+        metrics.cacheHit(u"messages", cached != None and cached[0] == mtime)
+        if cached == None or cached[0] != mtime:
+            cached = (mtime, cls.loadMessages(currentLocalePath))
+            cls._messageCatalogs[currentLocalePath] = cached
+        return cached[1]
+    
+    @classmethod
+    def extractAdditives(cls, dish):
+        """Returns (text, additives) of a dish as stored by the statistics,
+        additives as comma separated ids or None."""
+        title, description, additives, keyInfo = dish
+        return formatTitleAndDescription(title, description, keyInfo), u",".join(additives) if additives else None
     
     @classmethod
     def addListMenuContent(cls, menu, displayedKey, content):
@@ -184,40 +837,156 @@ class LunchMenu (object):
         l.append(content)
         menu.contents[displayedKey] = l  
     
+    @classmethod
+    def getClassifier(cls, messages):
+        """Returns the CounterClassifier for the message catalog, built once per catalog."""
+        key = CounterClassifier.catalogKey(messages)
+        classifier = cls._classifiers.get(key)
+        metrics.cacheHit(u"classifier", classifier != None)
+        if classifier == None:
+            classifier = CounterClassifier(messages)
+            cls._classifiers[key] = classifier
+        return classifier
+    
+    @classmethod
+    def fetchLunchJSON(cls, url, conditional=False):
+        """Downloads the lunch menu and returns (body, etag, lastModified).
+        
+        If conditional is True, the validators of the cached response are sent
+        and None is returned if the server reports that nothing changed.
+        """
+        headers = {"Accept-Encoding" : "gzip"}
+        if conditional:
+            etag, lastModified = cls.getCache().validators(url)
+            if etag:
+                headers["If-None-Match"] = etag
+            if lastModified:
+                headers["If-Modified-Since"] = lastModified
+        
+        with metrics.timer(u"fetch"):
+            result = cls.getHTTPClient().get(url, headers)
+        if conditional:
+            metrics.cacheHit(u"notModified", result.status == 304)
+        if conditional and result.status == 304:
+            log_debug(u"Lunch menu not modified: %s" % url)
+            return None
+        if result.status != 200:
+            from eurest_lunch_menu.lunch_menu_http import HTTPError
+            raise HTTPError(url, result.status, u"unexpected status")
+        body = result.body
+        if (result.getHeader("Content-Encoding") or "").lower() == "gzip":
+            import zlib
+            with metrics.timer(u"decompress"):
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body, result.getHeader("ETag"), result.getHeader("Last-Modified")
+    
+    @classmethod
+    def decodeLunchJSON(cls, lunchJSON):
+        import json
+        with metrics.timer(u"decode"):
+            return json.loads(lunchJSON)
+    
+    @classmethod
+    def fetchLunchObject(cls):
+        return cls.decodeLunchJSON(cls.fetchLunchJSON(cls._urls[0])[0])
+    
     @classmethod
     def readLunchMenus(cls, localeStr, messages):
-        if not cls._url:
-            return [Exception(messages[u"checkURL"])]*5, {}
+        return cls.readAllLunchMenus(((localeStr, messages),))[0]
+    
+    @classmethod
+    def readAllLunchMenus(cls, localesAndMessages):
+        """Downloads the lunch menu once and parses it for all given locales.
         
-        lunchMenus = [None, None, None, None, None]
-        localeStr = localeStr[:2]
+        localesAndMessages -- sequence of (localeString, messages) tuples
+        Returns a list of (lunchMenus, additivesDict) tuples in the same order.
+        """
+        if not cls._urls:
+            return [([Exception(messages[u"checkURL"])], {}) for _localeStr, messages in localesAndMessages]
         
-        with contextlib.closing(urllib2.urlopen(cls._url)) as urlInput:
-            lunchJSON = urlInput.read()
-            lunchObj = json.loads(lunchJSON)
-            
-        days = [u"mon", u"tue", u"wed", u"thu", u"fri"]
+        return cls.parseLunchMenus(cls.fetchLunchObject(), localesAndMessages)
+    
+    @classmethod
+    def parseLunchMenus(cls, lunchObj, localesAndMessages):
+        """Builds the lunch menus for all locales in a single pass over lunchObj.
         
-        additivesDict = {}
-        for additive in lunchObj[u"settings"][u"additives"]:
-            additivesDict[additive[u"id"]] = additive[u"text"][localeStr]
-            
-        for lunchDay in lunchObj[u"menu"]:
+        The lunch menus of each locale are sorted by date and contain only
+        the days of the feed, which may span any number of weeks."""
+        localeStrs = [localeStr[:2] for localeStr, _messages in localesAndMessages]
+        classifiers = [cls.getClassifier(messages) for _localeStr, messages in localesAndMessages]
+        lunchMenus = [[] for _ in localeStrs]
+        additivesDicts = [{} for _ in localeStrs]
+        
+        with metrics.timer(u"classify"):
+            cls._parseAdditives(lunchObj[u"settings"], localeStrs, additivesDicts)
+                
+            for lunchDay in lunchObj[u"menu"]:
+                for localeMenus, menu in zip(lunchMenus, cls._parseLunchDay(lunchDay, localeStrs, classifiers)):
+                    localeMenus.append(menu)
+        metrics.increment(u"classify.days", len(lunchObj[u"menu"]))
+        
+        for localeMenus in lunchMenus:
+            localeMenus.sort(key=lambda aLunchMenu: aLunchMenu.lunchDate)
+        return zip(lunchMenus, additivesDicts)
+    
+    @classmethod
+    def iterLunchMenus(cls, inFile, localesAndMessages, additivesDicts):
+        """Parses the lunch menu incrementally from the file-like object inFile.
+        
+        Yields one list of LunchMenu objects (one per locale) per day, so
+        memory usage is bounded by the size of a single day instead of the
+        whole feed. additivesDicts is a list with one dict per locale that
+        is filled as soon as the additives have been read.
+        """
+        localeStrs = [localeStr[:2] for localeStr, _messages in localesAndMessages]
+        classifiers = [cls.getClassifier(messages) for _localeStr, messages in localesAndMessages]
+        
+        from eurest_lunch_menu.lunch_menu_stream import JSONStreamReader
+        reader = JSONStreamReader(inFile)
+        for key, value, _isArrayItem in reader.iterMembers(arrayKeys=(u"menu",)):
+            if key == u"settings":
+                cls._parseAdditives(value, localeStrs, additivesDicts)
+            elif key == u"menu":
+                yield cls._parseLunchDay(value, localeStrs, classifiers)
+    
+    @classmethod
+    def streamLunchMenus(cls, url, localesAndMessages, additivesDicts):
+        """Downloads and parses the lunch menu day by day, see iterLunchMenus."""
+        with cls.getHTTPClient().open(url) as response:
+            if response.status != 200:
+                from eurest_lunch_menu.lunch_menu_http import HTTPError
+                raise HTTPError(url, response.status, response.reason)
+            for menus in cls.iterLunchMenus(response, localesAndMessages, additivesDicts):
+                yield menus
+    
+    @classmethod
+    def _parseAdditives(cls, settings, localeStrs, additivesDicts):
+        for additive in settings[u"additives"]:
+            additiveId = internString(additive[u"id"])
+            LunchDish.additiveTable.bit(additiveId)
+            for localeStr, additivesDict in zip(localeStrs, additivesDicts):
+                additivesDict[additiveId] = additive[u"text"][localeStr]
+    
+    @classmethod
+    def _parseLunchDay(cls, lunchDay, localeStrs, classifiers):
+        """Returns one LunchMenu per locale for the day object lunchDay."""
+        lunchDate = datetime.datetime.fromtimestamp(lunchDay[u"date"]).date()
+        menus = []
+        for _ in localeStrs:
             menu = LunchMenu()
-            
-            unixDate = lunchDay[u"date"]
-            weekDay = lunchDay[u"weekDay"]
-            menu.lunchDate = datetime.datetime.fromtimestamp(unixDate).date()
-            counters = lunchDay[u"counters"]
-            for counter in counters:
-                lineDesc = counter[u"title"][localeStr]
-                lineDescUpper = lineDesc.upper()
-                for dishDict in counter[u"dishes"]:
-                    if u"additives" in dishDict:
-                        additives = dishDict[u"additives"]
-                    else:
-                        additives = None
-                        
+            menu.lunchDate = lunchDate
+            menus.append(menu)
+        
+        for counter in lunchDay[u"counters"]:
+            categoriesPerLocale = [classifier.classify(counter[u"title"][localeStr]) for localeStr, classifier in zip(localeStrs, classifiers)]
+            if not any(categoriesPerLocale):
+                continue
+            for dishDict in counter[u"dishes"]:
+                # additives are the same in all languages
+                additiveIds = dishDict.get(u"additives")
+                for localeStr, categories, menu in zip(localeStrs, categoriesPerLocale, menus):
+                    if not categories:
+                        continue
                     if u"description" in dishDict:
                         description = dishDict[u"description"][localeStr].strip()
                         if len(description) <= 1:
@@ -229,24 +998,10 @@ class LunchMenu (object):
                         title = dishDict[u"title"][localeStr].strip()
                     else:
                         title = None
-                        
                     
-                    for keyBase in (u'soup', u'mainDishes', u'supplements', u'desserts'):
-                        if lineDescUpper.startswith(messages[keyBase + u"Source"]):
-                            keyInfo = lineDesc[len(messages[keyBase + u"Source"]):].strip()
-                            if len(keyInfo) <= 2:
-                                # ignore numbers and affixes
-                                keyInfo = None
-                            elif u"(" in keyInfo and u")" in keyInfo:
-                                # extract stuff in braces 
-                                keyInfo = keyInfo[keyInfo.index(u"(") + 1:keyInfo.index(u")")]
-                                
-                            lineContent = (title, description, additives, keyInfo)
-                            cls.addListMenuContent(menu, messages[keyBase + u"Displayed"], lineContent)
-            
-            lunchMenus[days.index(weekDay)] = menu
-                
-        return lunchMenus, additivesDict
+                    for displayedKey, keyInfo in categories:
+                        cls.addListMenuContent(menu, displayedKey, LunchDish.create(title, description, additiveIds, keyInfo))
+        return menus
 
 if __name__ == '__main__':
     LunchMenu.initialize()
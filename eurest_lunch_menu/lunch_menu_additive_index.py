@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+IndexedDish = namedtuple("IndexedDish", ["lunchDate", "category", "position", "dish"])
+
+class AdditiveIndex(object):
+    """Index from additive ids to the dishes containing them.
+
+    dishesWith is a dictionary lookup. dishesWithout for given dates only
+    looks at the dishes of these dates, so its cost does not depend on how
+    many other days have been indexed.
+    """
+
+    def __init__(self, additivesDict=None):
+        # id -> text of the known additives
+        self.additivesDict = dict(additivesDict) if additivesDict else {}
+        self._dishesByDate = {}
+        self._dishesByAdditive = {}
+        # dates whose lunch menus have been added, also days without lunch
+        self._coveredDates = set()
+
+    def copy(self):
+        """Returns an index with the same dishes that can be extended
+        without changing this one."""
+        index = AdditiveIndex(self.additivesDict)
+        index._dishesByDate = dict((aDate, list(entries)) for aDate, entries in self._dishesByDate.iteritems())
+        index._dishesByAdditive = dict((additiveId, set(entries)) for additiveId, entries in self._dishesByAdditive.iteritems())
+        index._coveredDates = set(self._coveredDates)
+        return index
+
+    def addLunchMenu(self, lunchMenu):
+        self._coveredDates.add(lunchMenu.lunchDate)
+        for category, dishes in lunchMenu.contents.iteritems():
+            for position, dish in enumerate(dishes):
+                self.addDish(lunchMenu.lunchDate, category, position, dish)
+
+    def addDish(self, lunchDate, category, position, dish):
+        entry = IndexedDish(lunchDate, category, position, dish)
+        self._dishesByDate.setdefault(lunchDate, []).append(entry)
+        if dish.additives:
+            for additiveId in dish.additives:
+                self._dishesByAdditive.setdefault(additiveId, set()).add(entry)
+
+    def covers(self, aDate):
+        """Returns True if the lunch menu of aDate has been added, or the
+        date was marked as covered."""
+        return aDate in self._coveredDates
+
+    def cover(self, dates):
+        """Marks dates as complete, e.g. days without lunch."""
+        self._coveredDates.update(dates)
+
+    def isKnownAdditive(self, additiveId):
+        return additiveId in self.additivesDict or additiveId in self._dishesByAdditive
+
+    def dishesWith(self, additiveId):
+        return frozenset(self._dishesByAdditive.get(additiveId, ()))
+
+    def dishesWithout(self, additiveIds, dates=None):
+        """Returns the dishes containing none of additiveIds, sorted by date.
+        If dates is given, only dishes served on these dates are returned."""
+        excluded = [self._dishesByAdditive[additiveId] for additiveId in set(additiveIds) if additiveId in self._dishesByAdditive]
+        if dates == None:
+            dates = self._dishesByDate.keys()
+        result = [entry for aDate in set(dates) for entry in self._dishesByDate.get(aDate, ())
+                  if not any(entry in dishes for dishes in excluded)]
+        return sorted(result, key=lambda entry: (entry.lunchDate, entry.category, entry.position))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+from lunchinator import log_exception
+
+class LunchMenuCache(object):
+    """Keeps the last good response per URL on disk, together with its
+    ETag and Last-Modified validators."""
+
+    def __init__(self, cacheDir):
+        self._cacheDir = cacheDir
+
+    def _basePath(self, url):
+        if type(url) == unicode:
+            url = url.encode("utf-8")
+        return os.path.join(self._cacheDir, hashlib.sha1(url).hexdigest())
+
+    def _writeFile(self, path, data):
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as outFile:
+            outFile.write(data)
+        try:
+            os.rename(tmpPath, path)
+        except OSError:
+            # Windows does not replace existing files
+            os.remove(path)
+            os.rename(tmpPath, path)
+
+    def load(self, url):
+        """Returns (body, etag, lastModified) or None if nothing is cached."""
+        basePath = self._basePath(url)
+        try:
+            with open(basePath + ".meta", "rb") as metaFile:
+                meta = json.load(metaFile)
+            if meta.get(u"url") != url:
+                return None
+            with open(basePath + ".json", "rb") as bodyFile:
+                body = bodyFile.read()
+        except IOError:
+            return None
+        except ValueError:
+            log_exception(u"Lunch menu cache for %s is corrupt" % url)
+            return None
+        return body, meta.get(u"etag"), meta.get(u"lastModified")
+
+    def validators(self, url):
+        """Returns (etag, lastModified) of the cached response, without reading the body."""
+        try:
+            with open(self._basePath(url) + ".meta", "rb") as metaFile:
+                meta = json.load(metaFile)
+        except (IOError, ValueError):
+            return None, None
+        if meta.get(u"url") != url:
+            return None, None
+        return meta.get(u"etag"), meta.get(u"lastModified")
+
+    def store(self, url, body, etag, lastModified):
+        try:
+            if not os.path.isdir(self._cacheDir):
+                os.makedirs(self._cacheDir)
+            basePath = self._basePath(url)
+            # body first, the meta file marks the entry as complete
+            self._writeFile(basePath + ".json", body)
+            self._writeFile(basePath + ".meta", json.dumps({u"url" : url,
+                                                            u"etag" : etag,
+                                                            u"lastModified" : lastModified}))
+        except:
+            log_exception(u"Could not write lunch menu cache")
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+class CounterClassifier(object):
+    """Maps counter titles to the displayed categories of a message catalog.
+
+    The result only depends on the counter title, so it is computed once
+    per distinct title and memoized.
+    """
+
+    keyBases = (u'soup', u'mainDishes', u'supplements', u'desserts')
+
+    def __init__(self, messages):
+        self._prefixes = self.catalogKey(messages)
+        self._memo = {}
+
+    @classmethod
+    def catalogKey(cls, messages):
+        """Returns a key identifying the parts of messages the classifier depends on."""
+        return tuple((messages[keyBase + u"Source"], messages[keyBase + u"Displayed"]) for keyBase in cls.keyBases)
+
+    def _extractKeyInfo(self, keyInfo):
+        keyInfo = keyInfo.strip()
+        if len(keyInfo) <= 2:
+            # ignore numbers and affixes
+            return None
+        elif u"(" in keyInfo and u")" in keyInfo:
+            # extract stuff in braces
+            return keyInfo[keyInfo.index(u"(") + 1:keyInfo.index(u")")]
+        return keyInfo
+
+    def classify(self, lineDesc):
+        """Returns a tuple of (displayedKey, keyInfo) tuples, one for every
+        category whose source prefix matches lineDesc."""
+        try:
+            return self._memo[lineDesc]
+        except KeyError:
+            pass
+
+        lineDescUpper = lineDesc.upper()
+        result = tuple((displayedKey, self._extractKeyInfo(lineDesc[len(source):]))
+                       for source, displayedKey in self._prefixes
+                       if lineDescUpper.startswith(source))
+        self._memo[lineDesc] = result
+        return result
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import re
+
+weekdayKeys = (u"monday", u"tuesday", u"wednesday", u"thursday", u"friday", u"saturday", u"sunday")
+monthKeys = (u"january", u"february", u"march", u"april", u"may", u"june",
+             u"july", u"august", u"september", u"october", u"november", u"december")
+
+_directivePattern = re.compile(u"%(.)")
+
+def formatDate(aDate, dateFormat, messages):
+    """Formats aDate like strftime, taking day and month names from the
+    message catalog instead of the process locale.
+
+    Supported directives are %A, %a, %B, %b (names from messages) and
+    %d, %m, %Y, %y, %j, %%.
+    """
+    def replace(match):
+        directive = match.group(1)
+        if directive == u"A":
+            return messages[weekdayKeys[aDate.weekday()]]
+        if directive == u"a":
+            return messages[weekdayKeys[aDate.weekday()]][:3]
+        if directive == u"B":
+            return messages[monthKeys[aDate.month - 1]]
+        if directive == u"b":
+            return messages[monthKeys[aDate.month - 1]][:3]
+        if directive == u"d":
+            return u"%02d" % aDate.day
+        if directive == u"m":
+            return u"%02d" % aDate.month
+        if directive == u"Y":
+            return u"%d" % aDate.year
+        if directive == u"y":
+            return u"%02d" % (aDate.year % 100)
+        if directive == u"j":
+            return u"%03d" % aDate.timetuple().tm_yday
+        if directive == u"%":
+            return u"%"
+        raise ValueError(u"Unsupported date format directive: %%%s" % directive)
+    return _directivePattern.sub(replace, dateFormat)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import bisect
+
+def nearestDate(sortedDates, aDate):
+    """Returns the date in sortedDates closest to aDate, preferring later
+    dates on ties, or None if sortedDates is empty."""
+    if not sortedDates:
+        return None
+    i = bisect.bisect_left(sortedDates, aDate)
+    if i == len(sortedDates):
+        return sortedDates[-1]
+    if i == 0 or sortedDates[i] - aDate <= aDate - sortedDates[i - 1]:
+        return sortedDates[i]
+    return sortedDates[i - 1]
+
+class LunchMenuDateIndex(object):
+    """Lunch menus keyed by their date.
+
+    Any number of days can be indexed; days without lunch (weekends,
+    holidays) are simply missing. Looking up a date is a dictionary access,
+    finding the nearest day a binary search over the sorted dates.
+    """
+
+    def __init__(self, lunchMenus=()):
+        self._menus = {}
+        for aLunchMenu in lunchMenus:
+            self._menus[aLunchMenu.lunchDate] = aLunchMenu
+        self._dates = sorted(self._menus)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __contains__(self, aDate):
+        return aDate in self._menus
+
+    def dates(self):
+        """Returns the sorted list of indexed dates."""
+        return list(self._dates)
+
+    def get(self, aDate):
+        return self._menus.get(aDate)
+
+    def position(self, aDate):
+        """Returns the position of aDate in dates(), or None if it is not indexed."""
+        if aDate not in self._menus:
+            return None
+        return bisect.bisect_left(self._dates, aDate)
+
+    def nearestDate(self, aDate):
+        """Returns the indexed date closest to aDate, or None if the index is empty."""
+        return nearestDate(self._dates, aDate)
+
+    def between(self, startDate, endDate):
+        """Returns the lunch menus from startDate to endDate (inclusive), sorted by date."""
+        start = bisect.bisect_left(self._dates, startDate)
+        end = bisect.bisect_right(self._dates, endDate)
+        return [self._menus[aDate] for aDate in self._dates[start:end]]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import threading
+import weakref
+
+class StringTable(object):
+    """Returns shared instances of equal (unicode) strings; the builtin
+    intern() only supports byte strings.
+
+    Without maxSize, strings are never released. With maxSize, the table
+    starts over once it is full: strings shared so far stay shared, but
+    reading a long history cannot grow it without limit.
+    """
+
+    def __init__(self, maxSize=None):
+        self._strings = {}
+        self._maxSize = maxSize
+
+    def intern(self, s):
+        if s == None:
+            return None
+        shared = self._strings.get(s)
+        if shared == None:
+            strings = self._strings
+            if self._maxSize != None and len(strings) >= self._maxSize:
+                strings = {}
+                self._strings = strings
+            shared = strings.setdefault(s, s)
+        return shared
+
+_internedStrings = StringTable()
+
+def internString(s):
+    """Returns a shared instance of the (unicode) string s. Interned
+    strings are never released, so only use this for small sets like
+    additive ids or key infos."""
+    return _internedStrings.intern(s)
+
+class AdditiveTable(object):
+    """Assigns a bit to every additive id, so the additives of a dish can be
+    tested with a single integer mask. Unknown ids get the next free bit."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits = {}
+        self._ids = []
+        # additive ids as listed by dishes : (shared ids, mask)
+        self._listed = {}
+
+    def bit(self, additiveId):
+        try:
+            return self._bits[additiveId]
+        except KeyError:
+            with self._lock:
+                if additiveId not in self._bits:
+                    self._ids.append(internString(additiveId))
+                    self._bits[additiveId] = 1 << (len(self._ids) - 1)
+                return self._bits[additiveId]
+
+    def mask(self, additiveIds):
+        mask = 0
+        if additiveIds:
+            for additiveId in additiveIds:
+                mask |= self.bit(additiveId)
+        return mask
+
+    def listed(self, additiveIds):
+        """Returns (ids, mask) of the additive ids as listed by a dish. ids
+        keeps their order and is shared by all dishes listing the same ids
+        in the same order; it is None if there are none."""
+        if not additiveIds:
+            return None, 0
+        key = tuple(additiveIds)
+        try:
+            return self._listed[key]
+        except KeyError:
+            return self._listed.setdefault(key, (tuple(internString(additiveId) for additiveId in key), self.mask(key)))
+
+    def knownIds(self):
+        return tuple(self._ids)
+
+class LunchDish(object):
+    """A single dish of a lunch menu.
+
+    Dishes are immutable and interned: equal dishes, e.g. the same dish on
+    different days or with identical texts in both languages, share one
+    instance as long as any of them is in use; dishes nobody refers to
+    anymore are released. Titles and descriptions are shared through a
+    bounded StringTable. additives keeps the order in which the dish lists
+    them, additiveMask has one bit per additive (see AdditiveTable). For
+    compatibility, a dish behaves like the tuple
+    (title, description, additives, keyInfo).
+    """
+    __slots__ = ("title", "description", "additives", "additiveMask", "keyInfo", "__weakref__")
+
+    additiveTable = AdditiveTable()
+    # distinct titles and descriptions of several months of lunch menus
+    _texts = StringTable(maxSize=16 * 1024)
+    _interned = weakref.WeakValueDictionary()
+    _internLock = threading.Lock()
+
+    def __init__(self, title, description, additives, additiveMask, keyInfo):
+        self.title = title
+        self.description = description
+        self.additives = additives
+        self.additiveMask = additiveMask
+        self.keyInfo = keyInfo
+
+    @classmethod
+    def create(cls, title, description, additiveIds, keyInfo):
+        """Returns the dish; additiveIds is a sequence of additive ids or None."""
+        additives, additiveMask = cls.additiveTable.listed(additiveIds)
+        key = (title, description, additives, keyInfo)
+        dish = cls._interned.get(key)
+        if dish == None:
+            with cls._internLock:
+                dish = cls._interned.get(key)
+                if dish == None:
+                    dish = cls(cls._texts.intern(title),
+                               cls._texts.intern(description),
+                               additives,
+                               additiveMask,
+                               internString(keyInfo))
+                    cls._interned[key] = dish
+        return dish
+
+    def hasAdditive(self, additiveId):
+        return bool(self.additiveMask & self.additiveTable.bit(additiveId))
+
+    def _asTuple(self):
+        return (self.title, self.description, self.additives, self.keyInfo)
+
+    def __iter__(self):
+        return iter(self._asTuple())
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, index):
+        return self._asTuple()[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, LunchDish):
+            return NotImplemented
+        return self.title == other.title and \
+               self.description == other.description and \
+               self.additives == other.additives and \
+               self.keyInfo == other.keyInfo
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((self.title, self.description, self.additives, self.keyInfo))
+
+    def __repr__(self):
+        return repr(self._asTuple())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import datetime
+import hashlib
+from StringIO import StringIO
+from eurest_lunch_menu.lunch_menu_html import categoryKeyBases, formatTitleAndDescription
+
+# JSON lines, comma separated values and iCalendar
+exportFormats = (u"json", u"csv", u"ics")
+
+csvColumns = ("canteen", "date", "locale", "category", "categoryTitle", "title", "description", "additives", "keyInfo")
+
+def _categories(lunchMenu, messages):
+    """Yields (key base, displayed category, dishes) in page order."""
+    for keyBase in categoryKeyBases:
+        displayedKey = messages[keyBase + u"Displayed"]
+        dishes = lunchMenu.contents.get(displayedKey)
+        if dishes:
+            yield keyBase, displayedKey, dishes
+
+def exportHeader(exportFormat):
+    """Returns the UTF-8 encoded text preceding the exported days."""
+    if exportFormat == u"csv":
+        return _csvRow(csvColumns)
+    if exportFormat == u"ics":
+        return _icsLines([u"BEGIN:VCALENDAR",
+                          u"VERSION:2.0",
+                          u"PRODID:-//eurest-lunch-menu//Lunch Menu Export//EN",
+                          u"CALSCALE:GREGORIAN"])
+    return ""
+
+def exportFooter(exportFormat):
+    """Returns the UTF-8 encoded text following the exported days."""
+    if exportFormat == u"ics":
+        return _icsLines([u"END:VCALENDAR"])
+    return ""
+
+def exportLunchMenu(exportFormat, lunchMenu, localeKey, messages, additivesDict, canteenURL, dateText, timestamp):
+    """Returns a lunch menu as UTF-8 encoded text in exportFormat.
+
+    json -- one JSON object per line with the categories and dishes
+    csv -- one row per dish, see csvColumns
+    ics -- one all-day event per day and language; timestamp (UTC) is
+           its DTSTAMP
+    """
+    if exportFormat == u"csv":
+        return _exportCSV(lunchMenu, localeKey, messages, canteenURL)
+    if exportFormat == u"ics":
+        return _exportICS(lunchMenu, localeKey, messages, additivesDict, canteenURL, dateText, timestamp)
+    return _exportJSON(lunchMenu, localeKey, messages, additivesDict, canteenURL)
+
+def _exportJSON(lunchMenu, localeKey, messages, additivesDict, canteenURL):
+    categories = []
+    additiveIds = set()
+    for keyBase, displayedKey, dishes in _categories(lunchMenu, messages):
+        categories.append({u"key" : keyBase,
+                           u"title" : displayedKey,
+                           u"dishes" : [{u"title" : dish.title,
+                                         u"description" : dish.description,
+                                         u"additives" : list(dish.additives or ()),
+                                         u"keyInfo" : dish.keyInfo} for dish in dishes]})
+        for dish in dishes:
+            additiveIds.update(dish.additives or ())
+    day = {u"canteen" : canteenURL,
+           u"date" : lunchMenu.lunchDate.isoformat(),
+           u"locale" : localeKey,
+           u"categories" : categories,
+           u"additives" : dict((additiveId, additivesDict.get(additiveId, u"")) for additiveId in additiveIds)}
+    return json.dumps(day, ensure_ascii=False, sort_keys=True).encode("utf-8") + "\n"
+
+def _csvRow(values):
+    out = StringIO()
+    csv.writer(out).writerow([value.encode("utf-8") if type(value) == unicode else value for value in values])
+    return out.getvalue()
+
+def _exportCSV(lunchMenu, localeKey, messages, canteenURL):
+    rows = []
+    for keyBase, displayedKey, dishes in _categories(lunchMenu, messages):
+        for dish in dishes:
+            rows.append(_csvRow((canteenURL,
+                                 lunchMenu.lunchDate.isoformat(),
+                                 localeKey,
+                                 keyBase,
+                                 displayedKey,
+                                 dish.title or u"",
+                                 dish.description or u"",
+                                 u",".join(dish.additives) if dish.additives else u"",
+                                 dish.keyInfo or u"")))
+    return "".join(rows)
+
+def _icsText(text):
+    return text.replace(u"\\", u"\\\\").replace(u";", u"\\;").replace(u",", u"\\,").replace(u"\n", u"\\n")
+
+def _icsLines(lines):
+    """Returns the content lines, folded at 75 octets, as UTF-8 encoded text."""
+    result = []
+    for line in lines:
+        encoded = line.encode("utf-8")
+        while len(encoded) > 75:
+            cut = 75
+            # do not split UTF-8 sequences
+            while ord(encoded[cut]) & 0xC0 == 0x80:
+                cut -= 1
+            result.append(encoded[:cut])
+            encoded = " " + encoded[cut:]
+        result.append(encoded)
+    return "".join(line + "\r\n" for line in result)
+
+def _exportICS(lunchMenu, localeKey, messages, additivesDict, canteenURL, dateText, timestamp):
+    descriptionLines = []
+    for _keyBase, displayedKey, dishes in _categories(lunchMenu, messages):
+        descriptionLines.append(displayedKey + u":")
+        for dish in dishes:
+            text = formatTitleAndDescription(dish.title, dish.description, dish.keyInfo) or u""
+            if dish.additives:
+                text += u" (%s)" % u", ".join(dish.additives)
+            descriptionLines.append(u"- " + text)
+    usedAdditives = sorted(set(additiveId for _keyBase, _displayedKey, dishes in _categories(lunchMenu, messages)
+                               for dish in dishes for additiveId in dish.additives or ()))
+    if usedAdditives:
+        descriptionLines.append(u"")
+        descriptionLines.extend(u"%s: %s" % (additiveId, additivesDict.get(additiveId, u"")) for additiveId in usedAdditives)
+
+    canteenHash = hashlib.sha1((canteenURL or u"").encode("utf-8")).hexdigest()[:12]
+    return _icsLines([u"BEGIN:VEVENT",
+                      u"UID:%s-%s-%s@eurest-lunch-menu" % (lunchMenu.lunchDate.strftime("%Y%m%d"), localeKey, canteenHash),
+                      u"DTSTAMP:%s" % timestamp.strftime("%Y%m%dT%H%M%SZ"),
+                      u"DTSTART;VALUE=DATE:%s" % lunchMenu.lunchDate.strftime("%Y%m%d"),
+                      u"DTEND;VALUE=DATE:%s" % (lunchMenu.lunchDate + datetime.timedelta(days=1)).strftime("%Y%m%d"),
+                      u"SUMMARY;LANGUAGE=%s:%s" % (localeKey, _icsText(u"%s %s" % (messages[u"lunchMenuFor"], dateText))),
+                      u"DESCRIPTION;LANGUAGE=%s:%s" % (localeKey, _icsText(u"\n".join(descriptionLines))),
+                      u"TRANSP:TRANSPARENT",
+                      u"END:VEVENT"])
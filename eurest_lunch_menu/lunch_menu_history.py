@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import datetime
+import os
+from eurest_lunch_menu.lunch_menu_terms import indexTerms, queryTerms, prefixRange
+
+class LunchMenuHistory(object):
+    """Persistent store of all lunch menus ever read, one row per dish.
+
+    Categories are stored locale independently by their key base (e.g.
+    'soup'), dates as ISO strings. Titles and descriptions are indexed by
+    their folded words for search(). The store is thread safe.
+    """
+
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS days (
+               canteen TEXT NOT NULL,
+               lunch_date TEXT NOT NULL,
+               locale TEXT NOT NULL,
+               updated TEXT NOT NULL,
+               PRIMARY KEY (canteen, lunch_date, locale))""",
+        """CREATE TABLE IF NOT EXISTS dishes (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               canteen TEXT NOT NULL,
+               lunch_date TEXT NOT NULL,
+               locale TEXT NOT NULL,
+               category TEXT NOT NULL,
+               position INTEGER NOT NULL,
+               title TEXT,
+               description TEXT,
+               key_info TEXT,
+               additives TEXT)""",
+        """CREATE INDEX IF NOT EXISTS dishes_day ON dishes (canteen, lunch_date, locale)""",
+        """CREATE INDEX IF NOT EXISTS dishes_date ON dishes (lunch_date)""",
+        """CREATE INDEX IF NOT EXISTS dishes_category ON dishes (category, lunch_date)""",
+        """CREATE INDEX IF NOT EXISTS dishes_title ON dishes (title)""",
+        """CREATE TABLE IF NOT EXISTS dish_additives (
+               dish_id INTEGER NOT NULL,
+               additive TEXT NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS dish_additives_additive ON dish_additives (additive, dish_id)""",
+        """CREATE INDEX IF NOT EXISTS dish_additives_dish ON dish_additives (dish_id)""",
+        """CREATE TABLE IF NOT EXISTS additives (
+               canteen TEXT NOT NULL,
+               locale TEXT NOT NULL,
+               additive TEXT NOT NULL,
+               text TEXT,
+               PRIMARY KEY (canteen, locale, additive))""",
+        """CREATE TABLE IF NOT EXISTS dish_terms (
+               term TEXT NOT NULL,
+               dish_id INTEGER NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS dish_terms_term ON dish_terms (term, dish_id)""",
+        """CREATE INDEX IF NOT EXISTS dish_terms_dish ON dish_terms (dish_id)""",
+    ]
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        if path != ":memory:" and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            for statement in self._schema:
+                self._conn.execute(statement)
+            if self._conn.execute("SELECT 1 FROM dish_terms LIMIT 1").fetchone() == None:
+                # store written before the search index existed
+                for dishId, title, description in self._conn.execute("SELECT id, title, description FROM dishes").fetchall():
+                    self._indexDish(dishId, title, description)
+            self._conn.commit()
+
+    @classmethod
+    def localeKey(cls, localeString):
+        return localeString[:2]
+
+    @classmethod
+    def dateKey(cls, aDate):
+        return aDate.isoformat()
+
+    @classmethod
+    def parseDate(cls, dateKey):
+        return datetime.datetime.strptime(dateKey, "%Y-%m-%d").date()
+
+    def _indexDish(self, dishId, title, description):
+        self._conn.executemany("INSERT INTO dish_terms (term, dish_id) VALUES (?, ?)",
+                               [(term, dishId) for term in indexTerms(title) | indexTerms(description)])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def storeDays(self, canteen, localeString, lunchMenus, categoryKeys, additivesDict):
+        """Replaces the stored days of lunchMenus in one transaction.
+
+        categoryKeys maps displayed category names to their key base.
+        Returns the number of days written.
+        """
+        locale = self.localeKey(localeString)
+        now = datetime.datetime.now().isoformat()
+        written = 0
+        with self._lock:
+            with self._conn:
+                for additiveId, text in additivesDict.iteritems():
+                    self._conn.execute("INSERT OR REPLACE INTO additives (canteen, locale, additive, text) VALUES (?, ?, ?, ?)",
+                                       (canteen, locale, additiveId, text))
+                for aLunchMenu in lunchMenus:
+                    dateKey = self.dateKey(aLunchMenu.lunchDate)
+                    for table in ("dish_additives", "dish_terms"):
+                        self._conn.execute("DELETE FROM %s WHERE dish_id IN "
+                                           "(SELECT id FROM dishes WHERE canteen = ? AND lunch_date = ? AND locale = ?)" % table,
+                                           (canteen, dateKey, locale))
+                    self._conn.execute("DELETE FROM dishes WHERE canteen = ? AND lunch_date = ? AND locale = ?",
+                                       (canteen, dateKey, locale))
+                    self._conn.execute("INSERT OR REPLACE INTO days (canteen, lunch_date, locale, updated) VALUES (?, ?, ?, ?)",
+                                       (canteen, dateKey, locale, now))
+                    for displayedKey, dishes in aLunchMenu.contents.iteritems():
+                        category = categoryKeys.get(displayedKey, displayedKey)
+                        for position, dish in enumerate(dishes):
+                            title, description, additives, keyInfo = dish
+                            cursor = self._conn.execute("INSERT INTO dishes (canteen, lunch_date, locale, category, position, title, description, key_info, additives) "
+                                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                                        (canteen, dateKey, locale, category, position, title, description, keyInfo,
+                                                         u",".join(additives) if additives else None))
+                            if additives:
+                                self._conn.executemany("INSERT INTO dish_additives (dish_id, additive) VALUES (?, ?)",
+                                                       [(cursor.lastrowid, additiveId) for additiveId in additives])
+                            self._indexDish(cursor.lastrowid, title, description)
+                    written += 1
+        return written
+
+    def dates(self, canteen, localeString, startDate=None, endDate=None):
+        """Returns the sorted dates with stored lunch menus."""
+        query = "SELECT lunch_date FROM days WHERE canteen = ? AND locale = ?"
+        args = [canteen, self.localeKey(localeString)]
+        if startDate != None:
+            query += " AND lunch_date >= ?"
+            args.append(self.dateKey(startDate))
+        if endDate != None:
+            query += " AND lunch_date <= ?"
+            args.append(self.dateKey(endDate))
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY lunch_date", args).fetchall()
+        return [self.parseDate(row[0]) for row in rows]
+
+    def dishRows(self, canteen, localeString, startDate, endDate):
+        """Returns (date, category, title, description, keyInfo, additives)
+        tuples of the given period, ordered like the lunch menus."""
+        with self._lock:
+            rows = self._conn.execute("SELECT lunch_date, category, title, description, key_info, additives FROM dishes "
+                                      "WHERE canteen = ? AND locale = ? AND lunch_date >= ? AND lunch_date <= ? "
+                                      "ORDER BY lunch_date, category, position",
+                                      (canteen, self.localeKey(localeString), self.dateKey(startDate), self.dateKey(endDate))).fetchall()
+        return [(self.parseDate(row[0]), row[1], row[2], row[3], row[4], tuple(row[5].split(u",")) if row[5] else None)
+                for row in rows]
+
+    def additives(self, canteen, localeString):
+        with self._lock:
+            rows = self._conn.execute("SELECT additive, text FROM additives WHERE canteen = ? AND locale = ?",
+                                      (canteen, self.localeKey(localeString))).fetchall()
+        return dict(rows)
+
+    def search(self, query, localeString=None, startDate=None, endDate=None):
+        """Returns (canteen, date, locale, category, title, description,
+        keyInfo, additives) tuples of the dishes matching every word of
+        query as a prefix, newest first.
+
+        Matching ignores case and accents; umlauts match both 'a' and 'ae'.
+        """
+        terms = queryTerms(query)
+        if not terms:
+            return []
+        # every term has to match, the longest (most selective) first
+        sql = "SELECT canteen, lunch_date, locale, category, title, description, key_info, additives FROM dishes WHERE " + \
+              " AND ".join(["id IN (SELECT dish_id FROM dish_terms WHERE term >= ? AND term < ?)"] * len(set(terms)))
+        args = []
+        for term in sorted(set(terms), key=len, reverse=True):
+            args.extend(prefixRange(term))
+        if localeString != None:
+            sql += " AND locale = ?"
+            args.append(self.localeKey(localeString))
+        if startDate != None:
+            sql += " AND lunch_date >= ?"
+            args.append(self.dateKey(startDate))
+        if endDate != None:
+            sql += " AND lunch_date <= ?"
+            args.append(self.dateKey(endDate))
+        sql += " ORDER BY lunch_date DESC, canteen DESC, locale DESC, category, position"
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        # many dishes share a day, parse every date once
+        dates = dict((dateKey, self.parseDate(dateKey)) for dateKey in set(row[1] for row in rows))
+        return [(row[0], dates[row[1]], row[2], row[3], row[4], row[5], row[6], tuple(row[7].split(u",")) if row[7] else None)
+                for row in rows]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from cgi import escape
+
+# order of the categories on a page
+categoryKeyBases = (u"soup", u"mainDishes", u"supplements", u"desserts")
+
+additiveScheme = u"additive:"
+
+def formatTitleAndDescription(title, description, keyInfo):
+    if title and description:
+        result = u"%s, %s" % (title, description)
+    elif title:
+        result = title
+    else:
+        result = description
+
+    if keyInfo:
+        return u"%s: %s" % (keyInfo.title(), result)
+    return result
+
+def additiveLink(additiveId, additivesDict):
+    """Returns an anchor for additiveId, its href is additiveScheme + id and
+    its title the text of the additive."""
+    return u'<a href="%s%s" title="%s">%s</a>' % (additiveScheme,
+                                                  escape(additiveId, True),
+                                                  escape(additivesDict.get(additiveId, u""), True),
+                                                  escape(additiveId))
+
+def renderDish(dish, additivesDict):
+    title, description, additives, keyInfo = dish
+    html = escape(formatTitleAndDescription(title, description, keyInfo) or u"")
+    if additives:
+        html += u" (%s)" % u", ".join(additiveLink(additiveId, additivesDict) for additiveId in additives)
+    return html
+
+def renderLunchMenu(lunchMenu, messages, additivesDict, dateText):
+    """Returns the HTML fragment of a lunch menu.
+
+    dateText is the formatted date shown in the heading. Days without
+    contents get the noLunchToday text, missing categories noContents.
+    """
+    parts = [u'<h3 align="center">%s %s</h3>' % (escape(messages[u"lunchMenuFor"]), escape(dateText))]
+    if not lunchMenu.isValid():
+        parts.append(u"<p>%s</p>" % escape(messages[u"noLunchToday"]))
+        return u"".join(parts)
+
+    for keyBase in categoryKeyBases:
+        displayedKey = messages[keyBase + u"Displayed"]
+        parts.append(u"<p><b>%s</b></p>" % escape(displayedKey))
+        dishes = lunchMenu.contents.get(displayedKey)
+        if not dishes:
+            parts.append(u"<p>%s</p>" % escape(messages[u"noContents"]))
+        elif len(dishes) == 1:
+            parts.append(u"<p>%s</p>" % renderDish(dishes[0], additivesDict))
+        else:
+            parts.append(u"<ul>%s</ul>" % u"".join(u"<li>%s</li>" % renderDish(dish, additivesDict) for dish in dishes))
+    return u"".join(parts)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import httplib
+import socket
+import threading
+import contextlib
+import urlparse
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+
+class HTTPError(Exception):
+    def __init__(self, url, status, reason):
+        super(HTTPError, self).__init__(u"HTTP Error %d: %s (%s)" % (status, reason, url))
+        self.url = url
+        self.status = status
+
+class HTTPResult(object):
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def getHeader(self, name):
+        return self.headers.getheader(name)
+
+class LunchMenuHTTPClient(object):
+    """Small HTTP/1.1 client that keeps connections alive per host.
+
+    Every request has a timeout, so a hanging server cannot block a
+    refresh forever. The client is thread safe; connections are taken
+    from and returned to a per-host pool.
+    """
+
+    maxRedirects = 5
+
+    def __init__(self, timeout=30, maxIdleConnectionsPerHost=4):
+        self._timeout = timeout
+        self._maxIdle = maxIdleConnectionsPerHost
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _hostKey(self, parsedURL):
+        scheme = parsedURL.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise ValueError(u"Unsupported URL scheme: %s" % parsedURL.scheme)
+        port = parsedURL.port
+        if port == None:
+            port = 443 if scheme == "https" else 80
+        return scheme, parsedURL.hostname, port
+
+    def _acquire(self, hostKey):
+        with self._lock:
+            idle = self._idle.get(hostKey)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = hostKey
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port, timeout=self._timeout), False
+        return httplib.HTTPConnection(host, port, timeout=self._timeout), False
+
+    def _release(self, hostKey, conn):
+        with self._lock:
+            idle = self._idle.setdefault(hostKey, [])
+            if len(idle) < self._maxIdle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request(self, url, headers):
+        """Returns (hostKey, connection, response) for a single request."""
+        parsedURL = urlparse.urlsplit(url)
+        hostKey = self._hostKey(parsedURL)
+        path = parsedURL.path or "/"
+        if parsedURL.query:
+            path += "?" + parsedURL.query
+        if type(path) == unicode:
+            path = path.encode("utf-8")
+
+        while True:
+            conn, reused = self._acquire(hostKey)
+            try:
+                if reused:
+                    metrics.increment(u"http.reusedConnections")
+                else:
+                    with metrics.timer(u"http.connect"):
+                        conn.connect()
+                with metrics.timer(u"http.request"):
+                    conn.request("GET", path, headers=headers)
+                    response = conn.getresponse()
+                metrics.increment(u"http.status.%d" % response.status)
+                return hostKey, conn, response
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                # the server closed the idle connection, retry with a new one
+
+    @contextlib.contextmanager
+    def open(self, url, headers=None):
+        """Sends a GET request and yields the httplib response, following
+        redirects. Read the response within the with block."""
+        headers = dict(headers) if headers else {}
+        for _ in range(self.maxRedirects + 1):
+            hostKey, conn, response = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                url = urlparse.urljoin(url, response.getheader("Location"))
+                response.read()
+                self._finish(hostKey, conn, response)
+                continue
+            break
+        else:
+            raise HTTPError(url, response.status, u"too many redirects")
+
+        try:
+            yield response
+        except:
+            conn.close()
+            raise
+        self._finish(hostKey, conn, response)
+
+    def _finish(self, hostKey, conn, response):
+        if response.isclosed() and not response.will_close:
+            self._release(hostKey, conn)
+        else:
+            conn.close()
+
+    def get(self, url, headers=None):
+        """Returns an HTTPResult with the complete body."""
+        with self.open(url, headers) as response:
+            with metrics.timer(u"http.read"):
+                body = response.read()
+            metrics.increment(u"http.bytes", len(body))
+            return HTTPResult(response.status, response.msg, body)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import contextlib
+
+class LunchMenuMetrics(object):
+    """In-process registry of counters and timers.
+
+    Counters are plain numbers (requests, bytes, cache hits and misses),
+    timers record the number of measurements, the total and the maximum
+    duration. Recording is a dictionary update under a lock, cheap enough
+    for the hot paths of a refresh. Names are dotted, e.g. "http.connect".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # name : [count, total seconds, max seconds]
+        self._timers = {}
+        self._since = time.time()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def addTime(self, name, seconds):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer == None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Measures the duration of the with block, also if it raises."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.time() - start)
+
+    def cacheHit(self, cacheName, hit):
+        """Counts a hit or miss of cacheName as cache.<cacheName>.hit/miss."""
+        self.increment(u"cache.%s.%s" % (cacheName, u"hit" if hit else u"miss"))
+
+    def dump(self):
+        """Returns a JSON serializable dict of all counters and timers,
+        durations in milliseconds."""
+        with self._lock:
+            counters = dict(self._counters)
+            timers = dict((name, list(timer)) for name, timer in self._timers.iteritems())
+            since = self._since
+        return {u"since" : since,
+                u"counters" : counters,
+                u"timers" : dict((name, {u"count" : count,
+                                         u"totalMs" : 1000. * total,
+                                         u"meanMs" : 1000. * total / count,
+                                         u"maxMs" : 1000. * maxTime})
+                                 for name, (count, total, maxTime) in timers.iteritems())}
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+            self._since = time.time()
+
+# the registry of this process
+metrics = LunchMenuMetrics()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import threading
+from lunchinator import log_exception
+
+class LunchMenuRefresher(threading.Thread):
+    """Refreshes the lunch menu in the background.
+
+    refreshFunc is called whenever secondsUntilOutdatedFunc returns a value
+    <= 0. refreshNow() wakes the thread up to check this immediately.
+    Readers never wait for a refresh.
+    """
+
+    # seconds to wait before retrying after an unexpected error
+    retryInterval = 60
+
+    def __init__(self, refreshFunc, secondsUntilOutdatedFunc):
+        threading.Thread.__init__(self, name="LunchMenuRefresher")
+        self.daemon = True
+        self._refreshFunc = refreshFunc
+        self._secondsUntilOutdatedFunc = secondsUntilOutdatedFunc
+        self._wakeUp = threading.Event()
+        self._stopped = False
+
+    def run(self):
+        while not self._stopped:
+            timeout = self._secondsUntilOutdatedFunc()
+            if timeout > 0:
+                self._wakeUp.wait(timeout)
+                if self._stopped:
+                    break
+            self._wakeUp.clear()
+            if timeout > 0 and self._secondsUntilOutdatedFunc() > 0:
+                # someone else refreshed in the meantime, or the wake-up
+                # came from readers while the last refresh was running
+                continue
+
+            try:
+                self._refreshFunc()
+            except:
+                log_exception(u"Error refreshing lunch menu")
+                self._wakeUp.wait(self.retryInterval)
+
+    def refreshNow(self):
+        self._wakeUp.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeUp.set()
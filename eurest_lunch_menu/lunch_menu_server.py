@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import BaseHTTPServer
+import SocketServer
+import threading
+import hashlib
+import gzip
+from collections import namedtuple
+from StringIO import StringIO
+from lunchinator import log_exception
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+
+class ServedResource(namedtuple("ServedResource", ["body", "gzipBody", "etag", "contentType"])):
+    """A response body of the LunchMenuServer, compressed once when created."""
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, body, contentType):
+        out = StringIO()
+        # no timestamp, equal bodies get equal compressed bodies
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as gzipFile:
+            gzipFile.write(body)
+        return cls(body, out.getvalue(), hashlib.sha1(body).hexdigest(), contentType)
+
+class ResourceUnavailable(Exception):
+    """Raised by the resource lookup if nothing can be served yet."""
+    pass
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def _acceptsGzip(self):
+        for coding in (self.headers.getheader("Accept-Encoding") or "").split(","):
+            params = [param.strip().lower() for param in coding.split(";")]
+            if params[0] == "gzip":
+                # q=0 (or 0.0, 0.00, ...) means not acceptable
+                return not any(param.startswith("q=") and param[2:].strip("0.") == "" for param in params[1:])
+        return False
+
+    def _respond(self, sendBody):
+        try:
+            resource = self.server.resourceForPath(self.path.split("?", 1)[0])
+        except ResourceUnavailable:
+            return self._sendStatus(503)
+        except:
+            log_exception(u"Error serving %s" % self.path)
+            return self._sendStatus(500)
+        if resource == None:
+            return self._sendStatus(404)
+
+        # the representations differ, so do their validators
+        useGzip = self._acceptsGzip()
+        etag = '"%s%s"' % (resource.etag, "-gz" if useGzip else "")
+        ifNoneMatch = self.headers.getheader("If-None-Match")
+        if ifNoneMatch and (ifNoneMatch.strip() == "*" or etag in [tag.strip() for tag in ifNoneMatch.split(",")]):
+            self._sendStatus(304, (("ETag", etag), ("Vary", "Accept-Encoding")))
+            return
+
+        body = resource.gzipBody if useGzip else resource.body
+        metrics.increment(u"server.status.200")
+        metrics.increment(u"server.bytes", len(body) if sendBody else 0)
+        self.send_response(200)
+        self.send_header("Content-Type", resource.contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Cache-Control", "no-cache")
+        if useGzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if sendBody:
+            self.wfile.write(body)
+
+    def _sendStatus(self, status, headers=()):
+        metrics.increment(u"server.status.%d" % status)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *_args):
+        pass
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class LunchMenuServer(object):
+    """Small read-only HTTP server for the lunch menus of this instance.
+
+    resourceForPath is called with the request path and returns a
+    ServedResource, None if the path does not exist, or raises
+    ResourceUnavailable. Responses are sent gzip compressed if the client
+    accepts it and carry ETags, so unchanged resources cost a 304.
+    """
+
+    def __init__(self, port, resourceForPath, host=""):
+        self._httpServer = _ThreadingHTTPServer((host, port), _Handler)
+        self._httpServer.resourceForPath = resourceForPath
+        self._thread = threading.Thread(target=self._httpServer.serve_forever, name="LunchMenuServer")
+        self._thread.daemon = True
+
+    @property
+    def port(self):
+        return self._httpServer.server_port
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._httpServer.shutdown()
+        self._httpServer.server_close()
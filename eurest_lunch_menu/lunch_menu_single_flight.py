@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.excInfo = None
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key.
+
+    The first caller for a key executes the function, everyone arriving
+    while it is running waits for and receives the same result (or
+    exception) instead of starting another execution.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            isLeader = call == None
+            if isLeader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not isLeader:
+            call.done.wait()
+            if call.excInfo != None:
+                raise call.excInfo[0], call.excInfo[1], call.excInfo[2]
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except:
+            call.excInfo = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def isRunning(self, key):
+        with self._lock:
+            return key in self._calls
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+
+class LunchMenuCanteen(namedtuple("LunchMenuCanteen", ["url",
+                                                       "lunchMenus",
+                                                       "toggleLunchMenus",
+                                                       "additives",
+                                                       "toggleAdditives",
+                                                       "loaded"])):
+    """Lunch menus of a single canteen.
+
+    loaded is True if the lunch menus were read successfully (from the
+    network or the cache). Otherwise lunchMenus contains one exception per
+    weekday, or is None if nothing has been read yet.
+    """
+    __slots__ = ()
+
+class SnapshotCache(object):
+    """Values derived from the data of a snapshot, such as indexes, HTML
+    fragments and serialized days, keyed by (cache name, key).
+
+    Snapshots that differ only in lastUpdate share their SnapshotCache, so
+    a refresh that changes nothing keeps everything computed so far.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, cacheName, key, create):
+        """Returns the value of key in cacheName, calling create() on a
+        miss. None is returned without being stored. If two threads create
+        the same value, both get the one stored first."""
+        value = self._values.get((cacheName, key))
+        metrics.cacheHit(cacheName, value != None)
+        if value == None:
+            value = create()
+            if value != None:
+                value = self._values.setdefault((cacheName, key), value)
+        return value
+
+_SnapshotBase = namedtuple("_SnapshotBase", ["urls",
+                                             "defaultLocaleString",
+                                             "messages",
+                                             "toggleMessages",
+                                             "canteens",
+                                             "lastUpdate",
+                                             "cache"])
+
+class LunchMenuSnapshot(_SnapshotBase):
+    """Consistent, immutable view of the lunch menu state.
+
+    A new snapshot is built for every update and published by replacing a
+    single reference, so readers never see menus and additives from
+    different updates. Neither the snapshot nor the contained objects may
+    be modified after publishing.
+
+    canteens contains one LunchMenuCanteen per configured URL. The menu
+    accessors refer to the first (primary) canteen; lunchMenus and
+    toggleLunchMenus are tuples with one entry per day of the feed, or None
+    if no lunch menu has been loaded yet. Use LunchMenu.getDateIndex to look
+    up days by date.
+
+    cache holds the values derived from the snapshot; see cached.
+    """
+    __slots__ = ()
+
+    def __new__(cls, urls, defaultLocaleString, messages, toggleMessages, canteens, lastUpdate, cache=None):
+        return _SnapshotBase.__new__(cls, urls, defaultLocaleString, messages, toggleMessages, canteens, lastUpdate,
+                                     cache if cache != None else SnapshotCache())
+
+    def _replace(self, **kwargs):
+        # changed data must not be served from the old cache
+        if "cache" not in kwargs and any(name != "lastUpdate" for name in kwargs):
+            kwargs["cache"] = SnapshotCache()
+        return _SnapshotBase._replace(self, **kwargs)
+
+    def cached(self, cacheName, key, create):
+        """Returns the value of key in the cache named cacheName, computed
+        by create() once for the data of this snapshot."""
+        return self.cache.get(cacheName, key, create)
+
+    def hasSameData(self, other):
+        """Returns True if other has the same lunch menus and messages,
+        differing at most in lastUpdate."""
+        return other != None and \
+               self.urls == other.urls and \
+               self.defaultLocaleString == other.defaultLocaleString and \
+               self.messages is other.messages and \
+               self.toggleMessages is other.toggleMessages and \
+               len(self.canteens) == len(other.canteens) and \
+               all(canteen is otherCanteen for canteen, otherCanteen in zip(self.canteens, other.canteens))
+
+    def isInitialized(self):
+        return self.lunchMenus != None
+
+    def primaryCanteen(self):
+        return self.canteens[0] if self.canteens else None
+
+    def getCanteen(self, url):
+        for canteen in self.canteens:
+            if canteen.url == url:
+                return canteen
+        return None
+
+    @property
+    def lunchMenus(self):
+        return self.canteens[0].lunchMenus if self.canteens else None
+
+    @property
+    def toggleLunchMenus(self):
+        return self.canteens[0].toggleLunchMenus if self.canteens else None
+
+    @property
+    def additives(self):
+        return self.canteens[0].additives if self.canteens else {}
+
+    @property
+    def toggleAdditives(self):
+        return self.canteens[0].toggleAdditives if self.canteens else {}
+
+    @property
+    def allLunchMenus(self):
+        if self.lunchMenus == None:
+            return None
+        return self.lunchMenus + self.toggleLunchMenus
+
+    def isGermanDefault(self):
+        return "de" in self.defaultLocaleString
+
+    def getEnglishMenus(self, canteen=None):
+        if canteen == None:
+            canteen = self.primaryCanteen()
+            if canteen == None:
+                return None
+        return canteen.toggleLunchMenus if self.isGermanDefault() else canteen.lunchMenus
+
+    def getGermanMenus(self, canteen=None):
+        if canteen == None:
+            canteen = self.primaryCanteen()
+            if canteen == None:
+                return None
+        return canteen.lunchMenus if self.isGermanDefault() else canteen.toggleLunchMenus
+
+    def getEnglishMessages(self):
+        return self.toggleMessages if self.isGermanDefault() else self.messages
+
+    def getGermanMessages(self):
+        return self.messages if self.isGermanDefault() else self.toggleMessages
+
+    def getEnglishWeekdays(self):
+        englishMessages = self.getEnglishMessages()
+        return [englishMessages['monday'], englishMessages['tuesday'], englishMessages['wednesday'], englishMessages['thursday'], englishMessages['friday']]
+
+    def getMessages(self, localeString):
+        return self.getGermanMessages() if "de" in localeString else self.getEnglishMessages()
+
+    def getMenus(self, localeString, canteen=None):
+        return self.getGermanMenus(canteen) if "de" in localeString else self.getEnglishMenus(canteen)
+
+    def getAdditives(self, localeString, canteen=None):
+        if canteen == None:
+            canteen = self.primaryCanteen()
+            if canteen == None:
+                return {}
+        if ("de" in localeString) == self.isGermanDefault():
+            return canteen.additives
+        return canteen.toggleAdditives
+
+    def getError(self, canteen=None):
+        """Returns the exception that prevented loading the lunch menus of
+        canteen, or None."""
+        if canteen == None:
+            canteen = self.primaryCanteen()
+        if canteen == None or canteen.loaded or not canteen.lunchMenus:
+            return None
+        return canteen.lunchMenus[0]
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import codecs
+import json
+
+class JSONStreamReader(object):
+    """Reads a top-level JSON object member by member from a file-like object.
+
+    Members whose key is in arrayKeys are not decoded as a whole; their
+    array items are yielded one by one instead. Only the current item and
+    one chunk are kept in memory.
+    """
+
+    _whitespace = u" \t\n\r"
+    _numberChars = u"0123456789.eE+-"
+
+    def __init__(self, inFile, chunkSize=64 * 1024):
+        self._inFile = inFile
+        self._chunkSize = chunkSize
+        self._decoder = json.JSONDecoder()
+        self._utf8Decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = u""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Reads the next chunk, returns False at end of input."""
+        if self._eof:
+            return False
+        data = self._inFile.read(self._chunkSize)
+        if not data:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._utf8Decoder.decode(b"", final=True)
+        else:
+            self._buf = self._buf[self._pos:] + self._utf8Decoder.decode(data)
+        self._pos = 0
+        return True
+
+    def _skipWhitespace(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return
+
+    def _peek(self):
+        self._skipWhitespace()
+        if self._pos >= len(self._buf):
+            raise ValueError("Unexpected end of JSON input")
+        return self._buf[self._pos]
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError("Expected one of '%s' at offset %d, got '%s'" % (chars, self._pos, c))
+        self._pos += 1
+        return c
+
+    @staticmethod
+    def _isNumber(value):
+        return type(value) in (int, long, float)
+
+    def _decodeValue(self):
+        self._skipWhitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # a number is complete only if followed by something else
+                if self._eof or not self._isNumber(value) or \
+                   (end < len(self._buf) and self._buf[end] not in self._numberChars):
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def iterMembers(self, arrayKeys=()):
+        """Yields (key, value, isArrayItem) tuples.
+
+        For keys in arrayKeys, one tuple is yielded per array item with
+        isArrayItem set to True.
+        """
+        self._expect(u"{")
+        if self._peek() == u"}":
+            self._pos += 1
+            return
+        while True:
+            key = self._decodeValue()
+            self._expect(u":")
+            if key in arrayKeys and self._peek() == u"[":
+                self._pos += 1
+                if self._peek() == u"]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield key, self._decodeValue(), True
+                        if self._expect(u",]") == u"]":
+                            break
+            else:
+                yield key, self._decodeValue(), False
+            if self._expect(u",}") == u"}":
+                return
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+
+_wordPattern = re.compile(u"\\w+", re.UNICODE)
+_germanFoldings = {u"ä" : u"ae", u"ö" : u"oe", u"ü" : u"ue", u"ß" : u"ss"}
+_germanFoldingPattern = re.compile(u"[%s]" % u"".join(_germanFoldings.keys()))
+
+def foldText(text):
+    """Returns text in lower case without accents, e.g. u'kasespatzle'
+    for u'Käsespätzle'."""
+    text = unicodedata.normalize("NFKD", text.lower().replace(u"ß", u"ss"))
+    return u"".join(c for c in text if not unicodedata.combining(c))
+
+def _expandGerman(text):
+    return _germanFoldingPattern.sub(lambda match: _germanFoldings[match.group(0)], text.lower())
+
+def indexTerms(text):
+    """Returns the set of search terms of a dish text.
+
+    Words containing umlauts are indexed with both foldings, so
+    'Käsespätzle' is found by 'käse', 'kase' and 'kaese'."""
+    terms = set()
+    if text:
+        for word in _wordPattern.findall(text):
+            terms.add(foldText(word))
+            terms.add(foldText(_expandGerman(word)))
+    terms.discard(u"")
+    return terms
+
+def queryTerms(query):
+    """Returns the folded words of a search query, in order."""
+    if type(query) != unicode:
+        query = query.decode("utf-8")
+    return [foldText(word) for word in _wordPattern.findall(query)]
+
+def prefixRange(term):
+    """Returns (lower, upper) such that lower <= t < upper holds exactly for
+    the strings t starting with term (UTF-8 keeps the code point order)."""
+    return term, term[:-1] + unichr(ord(term[-1]) + 1)
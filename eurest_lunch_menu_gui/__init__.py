@@ -1,67 +1,110 @@
 # -*- coding: utf-8 -*-
 from lunchinator.plugin import iface_gui_plugin
-from eurest_lunch_menu_gui.lunch_menu_widget import LunchMenuWidget
 from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+from eurest_lunch_menu.lunch_menu_html import formatTitleAndDescription
 from lunchinator.cli import LunchCLIModule
-from lunchinator.callables import AsyncCall
-from functools import partial
+from lunchinator import log_exception
+import datetime
+import sys
 
 class lunch_menu_structured(iface_gui_plugin, LunchCLIModule):
     def __init__(self):
         iface_gui_plugin.__init__(self)
         LunchCLIModule.__init__(self)
-        self.options = [((u"url", u"Lunch Menu URL", self._urlChanged), "")]
-        self._initLunchMenu = None
+        self.options = [((u"url", u"Lunch Menu URL(s), separated by spaces", self._urlChanged), ""),
+                        ((u"history_weeks", u"Number of previous weeks to show", self._historyWeeksChanged), 1),
+                        ((u"serve_port", u"Serve the lunch menu to other instances on this port (0 = off)", self._servePortChanged), 0)]
+        self._updateListener = None
+        self._widget = None
         
     def activate(self):
         iface_gui_plugin.activate(self)
         self._widget = None
+        LunchMenu.startRefresher(self.get_option(u"url"))
+        self._startServer(self.get_option(u"serve_port"))
         
     def deactivate(self):
+        self._startServer(0)
+        LunchMenu.stopRefresher()
         iface_gui_plugin.deactivate(self)
     
     def get_displayed_name(self):
         return "Eurest Lunch Menu"
 
     def create_widget(self, parent):
+        # PyQt4 is only needed once the widget is shown, not for the CLI
+        from eurest_lunch_menu_gui.lunch_menu_widget import LunchMenuWidget
         self._widget = LunchMenuWidget(parent)
-        # TODO update regularly
-        self._initLunchMenu = AsyncCall(self._widget,
-                                        self.logger,
-                                        LunchMenu.initialize,
-                                        self._widget.createNotebook)
+        self._widget.historyWeeks = self.get_option(u"history_weeks")
+        # the listener is called from the refreshing thread, the signal
+        # delivers the update to the GUI thread
+        self._updateListener = self._widget.lunchMenuUpdated.emit
+        LunchMenu.addUpdateListener(self._updateListener)
 
-        # first time, call initializeLayout instead of createNotebook        
-        AsyncCall(self._widget,
-                  self.logger,
-                  LunchMenu.initialize,
-                  self._widget.initializeLayout)(self.get_option(u"url"))
+        # the refresher renders the cached lunch menu first, then updates it
+        if LunchMenu.isInitialized():
+            self._widget.updateLunchMenu()
+        else:
+            LunchMenu.requestRefresh()
         return self._widget
     
     def destroy_widget(self):
-        self._initLunchMenu = None
+        if self._updateListener != None:
+            LunchMenu.removeUpdateListener(self._updateListener)
+            self._updateListener = None
         self._widget = None
         iface_gui_plugin.destroy_widget(self)
     
     def _urlChanged(self, _oldVal, newVal):
+        LunchMenu.setURL(newVal)
+        LunchMenu.requestRefresh()
+        return newVal
+    
+    def _startServer(self, port):
+        try:
+            LunchMenu.startServer(port)
+        except:
+            log_exception(u"Could not serve the lunch menu on port %d" % port)
+    
+    def _servePortChanged(self, _oldVal, newVal):
+        if self.is_activated:
+            self._startServer(newVal)
+        return newVal
+    
+    def _historyWeeksChanged(self, _oldVal, newVal):
         if self._widget != None:
-            self._initLunchMenu(newVal)
+            self._widget.setHistoryWeeks(newVal)
         return newVal
     
     def add_menu(self,menu):
         pass
     
-    def getWeekdays(self):
-        return [day.lower() for day in LunchMenu.getEnglishWeekdays()]
+    def getWeekdays(self, snapshot=None):
+        if snapshot == None:
+            snapshot = LunchMenu.snapshot()
+        return [day.lower() for day in snapshot.getEnglishWeekdays()]
     
-    def handleCommand(self, cmd):
+    def parseDate(self, arg):
+        try:
+            return datetime.datetime.strptime(arg, "%Y-%m-%d").date()
+        except ValueError:
+            return None
+    
+    def handleCommand(self, cmd, snapshot):
         cmd = cmd.lower()
-        if cmd in self.getWeekdays():
-            self.weekdayToPrint = self.getWeekdays().index(cmd)
+        if cmd in self.getWeekdays(snapshot):
+            self.weekdayToPrint = self.getWeekdays(snapshot).index(cmd)
             return True
         elif cmd == 'tomorrow':
             self.weekdayToPrint = self.weekdayToPrint + 1
             return True
+        elif self.parseDate(cmd) != None:
+            self.dateToPrint = self.parseDate(cmd)
+            return True
+        elif cmd == 'html':
+            self.htmlToPrint = True
+            return True
         elif cmd == 'de':
             self.languageToPrint = 'de'
             return True
@@ -78,37 +121,207 @@ class lunch_menu_structured(iface_gui_plugin, LunchCLIModule):
         Print the lunch menu.
         Usage: lunchmenu [de | en]                              - print today's lunch menu, in German or English
                lunchmenu today | tomorrow | <weekday> [de | en] - print lunch menu of a specific week day
+               lunchmenu <YYYY-MM-DD> [de | en]                 - print the lunch menu of any past day
+               lunchmenu ... html                               - print the lunch menu as HTML fragment
+               lunchmenu week [last | <YYYY-MM-DD>] [de | en] [--without <ids>]
+                                                                - print all dishes of a week, optionally only
+                                                                  those without the given additives, e.g. 1,3
+               lunchmenu search <words> [de | en] [--since <YYYY-MM-DD>]
+                                                                - search all lunch menus ever read for dishes
+                                                                  containing words starting with <words>
+               lunchmenu export [last | <YYYY-MM-DD> [<YYYY-MM-DD>]] [de | en | both] [json | csv | ics]
+                                                                - export the lunch menus of a week or a date range
+                                                                  as JSON lines, CSV or iCalendar
+               lunchmenu stats [--json] [--reset] [--profile]   - print timers and counters of this process,
+                                                                  --profile refreshes the lunch menu under cProfile
         """
         import shlex
         args = shlex.split(args)
         
+        if len(args) > 0 and args[0].lower() == "stats":
+            return self.printStats(args[1:])
+        
+        snapshot = LunchMenu.snapshot()
+        if len(args) > 0 and args[0].lower() == "week":
+            return self.printWeek(args[1:], snapshot)
+        if len(args) > 0 and args[0].lower() == "search":
+            return self.printSearch(args[1:], snapshot)
+        if len(args) > 0 and args[0].lower() == "export":
+            return self.printExport(args[1:], snapshot)
+        
         self.weekdayToPrint = LunchMenu.today().weekday()
-        self.languageToPrint = LunchMenu.defaultLocaleString
+        self.dateToPrint = None
+        self.htmlToPrint = False
+        self.languageToPrint = snapshot.defaultLocaleString
         
-        if len(args) > 0:
-            if not self.handleCommand(args.pop(0)):
+        while len(args) > 0:
+            if not self.handleCommand(args.pop(0), snapshot):
                 return False
             
-        if len(args) > 0:
-            if not self.handleCommand(args.pop(0)):
+        if not snapshot.isInitialized():
+            print snapshot.getMessages(self.languageToPrint)['initializing']
+            return
+        
+        for canteen in snapshot.canteens:
+            if len(snapshot.canteens) > 1:
+                print "=== %s ===" % canteen.url
+            self.printLunchMenu(snapshot, canteen)
+    
+    def printWeek(self, args, snapshot):
+        languageToPrint = snapshot.defaultLocaleString
+        weekDate = LunchMenu.today()
+        without = []
+        while len(args) > 0:
+            arg = args.pop(0)
+            if arg.lower() in ("de", "en"):
+                languageToPrint = arg.lower()
+            elif arg.lower() == "last":
+                weekDate = LunchMenu.today() - datetime.timedelta(days=7)
+            elif self.parseDate(arg) != None:
+                weekDate = self.parseDate(arg)
+            elif arg == "--without" and len(args) > 0:
+                without = [anId.strip() for anId in args.pop(0).decode("utf-8").split(u",") if anId.strip()]
+            else:
+                print "unknown argument: %s" % arg
+                self.printHelp("lunchmenu")
                 return False
-            
-        lunchMenu = LunchMenu.getLunchMenu(self.weekdayToPrint, self.languageToPrint)
-        if lunchMenu == None:
+        
+        if not snapshot.isInitialized():
+            print snapshot.getMessages(languageToPrint)['initializing']
+            return
+        
+        monday = weekDate - datetime.timedelta(days=weekDate.weekday())
+        weekDates = [monday + datetime.timedelta(days=i) for i in range(7)]
+        # the index is cached per snapshot, days of older weeks are read from the history
+        entries = LunchMenu.findDishesWithout(without, languageToPrint, weekDates, snapshot)
+        index = LunchMenu.getAdditiveIndex(languageToPrint, snapshot)
+        unknown = [anId for anId in without if not index.isKnownAdditive(anId)]
+        if unknown:
+            print "Unknown additives: %s" % u", ".join(unknown)
+        
+        lunchDate = None
+        for entry in entries:
+            if entry.lunchDate != lunchDate:
+                lunchDate = entry.lunchDate
+                print (u"*** %s ***" % LunchMenu.formatDate(lunchDate, languageToPrint, snapshot)).encode("utf-8")
+            text = formatTitleAndDescription(entry.dish.title, entry.dish.description, entry.dish.keyInfo) or u""
+            if entry.dish.additives:
+                text += u" (%s)" % u", ".join(entry.dish.additives)
+            print (u" - %s: %s" % (entry.category, text)).encode("utf-8")
+    
+    def printSearch(self, args, snapshot):
+        languageToPrint = None
+        since = None
+        words = []
+        while len(args) > 0:
+            arg = args.pop(0)
+            if arg.lower() in ("de", "en"):
+                languageToPrint = arg.lower()
+            elif arg == "--since" and len(args) > 0 and self.parseDate(args[0]) != None:
+                since = self.parseDate(args.pop(0))
+            else:
+                words.append(arg)
+        
+        if not words:
+            self.printHelp("lunchmenu")
+            return False
+        
+        results = LunchMenu.searchDishes(" ".join(words), languageToPrint, since, snapshot=snapshot)
+        if not results:
+            print "No dishes found."
+        for canteen, lunchDate, localeKey, category, dish in results:
+            print (u"%s [%s] %s: %s" % (LunchMenu.formatDate(lunchDate, "en_US", snapshot), localeKey, category, dish.title)).encode("utf-8")
+    
+    def printExport(self, args, snapshot):
+        from eurest_lunch_menu.lunch_menu_export import exportFormats
+        languages = [snapshot.defaultLocaleString]
+        exportFormat = u"json"
+        dates = []
+        while len(args) > 0:
+            arg = args.pop(0)
+            if arg.lower() in ("de", "en"):
+                languages = [arg.lower()]
+            elif arg.lower() == "both":
+                languages = ["de", "en"]
+            elif arg.lower() in exportFormats:
+                exportFormat = arg.lower().decode("utf-8")
+            elif arg.lower() == "last" and not dates:
+                dates.append(LunchMenu.today() - datetime.timedelta(days=7))
+            elif self.parseDate(arg) != None and len(dates) < 2:
+                dates.append(self.parseDate(arg))
+            else:
+                print "unknown argument: %s" % arg
+                self.printHelp("lunchmenu")
+                return False
+        
+        if not snapshot.isInitialized():
+            print snapshot.getMessages(languages[0])['initializing']
+            return
+        
+        if len(dates) == 2:
+            startDate, endDate = min(dates), max(dates)
+        else:
+            weekDate = dates[0] if dates else LunchMenu.today()
+            startDate = weekDate - datetime.timedelta(days=weekDate.weekday())
+            endDate = startDate + datetime.timedelta(days=6)
+        for part in LunchMenu.iterExportedLunchMenus(startDate, endDate, languages, exportFormat, snapshot):
+            sys.stdout.write(part)
+        sys.stdout.flush()
+    
+    def printStats(self, args):
+        unknown = [arg for arg in args if arg not in ("--json", "--reset", "--profile")]
+        if unknown:
+            print "unknown argument: %s" % unknown[0]
+            self.printHelp("lunchmenu")
+            return False
+        
+        if "--profile" in args:
+            import cProfile
+            import pstats
+            profile = cProfile.Profile()
+            profile.runcall(LunchMenu.initialize)
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(30)
+        
+        dump = metrics.dump()
+        if "--reset" in args:
+            metrics.reset()
+        if "--json" in args:
+            import json
+            print json.dumps(dump, sort_keys=True)
+            return
+        
+        print "%-32s %8s %12s %12s %12s" % ("timer", "count", "total ms", "mean ms", "max ms")
+        for name, timer in sorted(dump[u"timers"].iteritems()):
+            print "%-32s %8d %12.1f %12.2f %12.2f" % (name, timer[u"count"], timer[u"totalMs"], timer[u"meanMs"], timer[u"maxMs"])
+        print "%-32s %8s" % ("counter", "value")
+        for name, value in sorted(dump[u"counters"].iteritems()):
+            print "%-32s %8d" % (name, value)
+    
+    def printLunchMenu(self, snapshot, canteen):
+        dateToPrint = self.dateToPrint
+        if dateToPrint == None:
+            today = LunchMenu.today()
+            dateToPrint = today + datetime.timedelta(days=self.weekdayToPrint - today.weekday())
+        lunchMenu = LunchMenu.getLunchMenuForDate(dateToPrint, self.languageToPrint, snapshot, canteen)
+        if self.htmlToPrint and type(lunchMenu) == LunchMenu:
+            print LunchMenu.getLunchMenuHTML(dateToPrint, self.languageToPrint, snapshot, canteen).encode("utf-8")
+        elif lunchMenu == None:
             print "No lunch for this day."
+        elif isinstance(lunchMenu, Exception):
+            print "%s %s" % (snapshot.getMessages(self.languageToPrint)['otherException'], lunchMenu)
         else:
-            print "*** Lunch menu for %s ***" % (lunchMenu.lunchDate.strftime(LunchMenu.getEnglishMessages()['dateFormatDisplayed']))
+            print "*** Lunch menu for %s ***" % (LunchMenu.formatDate(lunchMenu.lunchDate, "en_US", snapshot))
             
-            messages = LunchMenu.getMessages(self.languageToPrint)
-            print "%s: %s" % (messages['soupDisplayed'], lunchMenu.contents[messages['soupDisplayed']])
+            messages = snapshot.getMessages(self.languageToPrint)
+            print "%s: %s" % (messages['soupDisplayed'], lunchMenu.contents.get(messages['soupDisplayed'], []))
             print "%s:" % messages['supplementsDisplayed']
-            for aSideDish in lunchMenu.contents[messages['supplementsDisplayed']]:
+            for aSideDish in lunchMenu.contents.get(messages['supplementsDisplayed'], []):
                 print " - %s" % aSideDish
             print "%s:" % messages['mainDishesDisplayed']
-            for aSideDish in lunchMenu.contents[messages['mainDishesDisplayed']]:
+            for aSideDish in lunchMenu.contents.get(messages['mainDishesDisplayed'], []):
                 print " - %s" % aSideDish
             print "%s:" % messages['dessertsDisplayed']
-            for aSideDish in lunchMenu.contents[messages['dessertsDisplayed']]:
+            for aSideDish in lunchMenu.contents.get(messages['dessertsDisplayed'], []):
                 print " - %s" % aSideDish
         
     def complete_lunchmenu(self, text, line, begidx, endidx):
@@ -116,8 +329,17 @@ class lunch_menu_structured(iface_gui_plugin, LunchCLIModule):
         
         if argNum == 1:
             # subcommand
-            allCommands = ["de", "en", "today", "tomorrow"] + self.getWeekdays()
+            allCommands = ["de", "en", "today", "tomorrow", "week", "search", "export", "stats"] + self.getWeekdays()
             return [aVal for aVal in allCommands if aVal.startswith(text)]
+        elif argNum > 1 and line.split()[1].lower() == "export":
+            from eurest_lunch_menu.lunch_menu_export import exportFormats
+            return [aVal for aVal in ["last", "de", "en", "both"] + list(exportFormats) if aVal.startswith(text)]
+        elif argNum > 1 and line.split()[1].lower() == "stats":
+            return [aVal for aVal in ("--json", "--reset", "--profile") if aVal.startswith(text)]
+        elif argNum > 1 and line.split()[1].lower() == "search":
+            return [aVal for aVal in ("de", "en", "--since") if aVal.startswith(text)]
+        elif argNum == 2 and line.split()[1].lower() == "week":
+            return [aVal for aVal in ("de", "en", "--without") if aVal.startswith(text)]
         elif argNum == 2:
-            return [aVal for aVal in ("de", "en") if aVal.startswith(text)]
+            return [aVal for aVal in ("de", "en", "html") if aVal.startswith(text)]
         
@@ -2,12 +2,9 @@
 import os
 import inspect
 import sys
-import locale
-import subprocess
-from PyQt4.QtGui import QLabel, QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QComboBox, QTextEdit, QStackedWidget, QToolButton, QFont, QMessageBox, QSizePolicy, QTextListFormat
-from PyQt4.QtCore import Qt, QSize, QEvent, QPoint
-from lunchinator import log_exception, log_debug, convert_string
-from lunchinator.utilities import getPlatform, PLATFORM_WINDOWS
+from PyQt4.QtGui import QLabel, QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QComboBox, QTextBrowser, QStackedWidget, QToolButton, QFont, QSizePolicy, QFrame, QToolTip
+from PyQt4.QtCore import Qt, QEvent, pyqtSignal
+from lunchinator import convert_string
 
 try:
     from eurest_lunch_menu import LunchMenu
@@ -16,83 +13,82 @@ except ImportError:
     if currentFolder not in sys.path:
         sys.path.insert(0, currentFolder)
     from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_date_index import nearestDate
+from eurest_lunch_menu.lunch_menu_html import additiveScheme
+from eurest_lunch_menu.lunch_menu_date_format import formatDate
+from eurest_lunch_menu.lunch_menu_metrics import metrics
     
-class GrowingTextEdit(QTextEdit):
-    def __init__(self, parent, messages, additivesDict):
-        super(GrowingTextEdit, self).__init__(parent)  
-        self.document().contentsChanged.connect(self.sizeChange)
-
-        self.additives = {}
-        self.messages = messages
+class LunchMenuView(QTextBrowser):
+    """Read-only view of the HTML fragment of a lunch menu that shows the
+    text of an additive as tooltip."""
+    def __init__(self, parent, html, additivesDict):
+        super(LunchMenuView, self).__init__(parent)
         self.additivesDict = additivesDict
-        self.heightMin = 0
-        self.heightMax = 65000
-        self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Maximum)
-        self.sizeChange()
-
-    def sizeChange(self):
-        docHeight = self.document().size().height()
-        if self.heightMin <= docHeight <= self.heightMax:
-            self.setMinimumHeight(docHeight)
-            self.setMaximumHeight(docHeight)
-            
-    def setVisible(self, *args, **kwargs):
-        QTextEdit.setVisible(self, *args, **kwargs)
-        self.sizeChange()
-            
-    def sizeHint(self):
-        return QSize(QWidget.sizeHint(self).width(), self.minimumHeight())
-    
-    def showToolTip(self, posX, posY):
-        cursor = self.cursorForPosition(QPoint(posX, posY))
-        offset = cursor.position()
-        if offset - 1 in self.additives:
-            # also display additive if mouse over next character
-            offset -= 1
-        if offset in self.additives:
-            self.setToolTip(u"%s: %s" % (self.additives[offset], self.additivesDict[self.additives[offset]]))
+        self.setOpenLinks(False)
+        self.setFrameShape(QFrame.NoFrame)
+        self.document().setIndentWidth(10)
+        self.setHtml(html)
     
     def event(self, event):
-        if event.type() == QEvent.Resize:
-            self.sizeChange()
-        elif event.type() == QEvent.ToolTip:
-            self.showToolTip(event.x(), event.y())
-        return QTextEdit.event(self, event)
-    
-    def append(self, text, additives):
-        if additives:
-            text += u" ("
-            selfText = convert_string(self.toPlainText())
-            if selfText:
-                selfLen = len(selfText) + 1 # newline at end
+        if event.type() == QEvent.ToolTip:
+            anchor = convert_string(self.anchorAt(self.viewport().mapFromGlobal(event.globalPos())))
+            if anchor.startswith(additiveScheme):
+                additive = anchor[len(additiveScheme):]
+                QToolTip.showText(event.globalPos(), u"%s: %s" % (additive, self.additivesDict.get(additive, u"")), self)
             else:
-                selfLen = 0
-            textLen = selfLen + len(text)
-            
-            first = True
-            for additive in additives:
-                if not first:
-                    text += u", "
-                    textLen += 2
-                    
-                for pos in xrange(textLen, textLen + len(additive)): 
-                    self.additives[pos] = additive
-                text += additive
-                
-                textLen += len(additive)
-                first = False
-            text += u")"
-        super(GrowingTextEdit, self).append(text)
+                QToolTip.hideText()
+            return True
+        return QTextBrowser.event(self, event)
             
 class LunchMenuWidget(QWidget):
     textViewIndex = 0
     textViewAdditivesMap = {}
     
+    # emitted from any thread with the new LunchMenuSnapshot
+    lunchMenuUpdated = pyqtSignal(object)
+    
     def __init__(self, parent):
         super(LunchMenuWidget, self).__init__(parent)
         
+        self._layoutInitialized = False
+        self._snapshot = None
+        # number of weeks before the current one that are shown from the history
+        self.historyWeeks = 0
+        # dates of the combo box entries, sorted
+        self._dates = []
+        self._datePositions = {}
+        self._toggled = False
+        # pages are built when they are shown first, see buildPage
+        self._dateIndexes = None
+        self._error = None
+        self._catalogs = None
+        # (toggle, date) of the notebook pages, date is None for the error page
+        self._pageKeys = []
+        self._pageFingerprints = {}
+        self._builtPages = set()
         box = QVBoxLayout(self)
         box.addWidget(QLabel(u"Initializing...", self))
+        
+        self.lunchMenuUpdated.connect(self.updateLunchMenu, type=Qt.QueuedConnection)
+    
+    def updateLunchMenu(self, snapshot=None):
+        if snapshot == None:
+            snapshot = LunchMenu.snapshot()
+        if not snapshot.isInitialized():
+            return
+        if self._layoutInitialized and snapshot is self._snapshot:
+            # the built pages are still valid
+            return
+        self._snapshot = snapshot
+        if self._layoutInitialized:
+            self.createNotebook()
+        else:
+            self.initializeLayout()
+    
+    def setHistoryWeeks(self, historyWeeks):
+        self.historyWeeks = historyWeeks
+        if self._layoutInitialized:
+            self.createNotebook()
     
     def initializeLayout(self):
         layout = self.layout()
@@ -102,11 +98,7 @@ class LunchMenuWidget(QWidget):
             child.widget().deleteLater()
             child = layout.takeAt(0)
         
-        self.messages = LunchMenu.messages()
-        self.toggleMessages = LunchMenu.toggleMessages()
-        
-        self.additives = LunchMenu.additives()
-        self.toggleAdditives = LunchMenu.toggleAdditives()
+        self.messages = self._snapshot.messages
         
         buttonBar = self.createButtonBar(self)
         
@@ -114,6 +106,7 @@ class LunchMenuWidget(QWidget):
         
         self.menuNotebook = QStackedWidget(self)
         self.createNotebook()
+        self._layoutInitialized = True
         layout.addWidget(self.menuNotebook)
         
         self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
@@ -130,65 +123,42 @@ class LunchMenuWidget(QWidget):
     
     def goRight(self):
         curIndex = self.combobox.currentIndex()
-        if curIndex < 4:
+        if curIndex < self.combobox.count() - 1:
             self.combobox.setCurrentIndex(curIndex + 1)
     
     def goToday(self):
-        now = LunchMenu.today()
-        
-        minDelta = sys.maxint
-        minDeltaI = 0
-        i = 0
-        for aLunchMenu in LunchMenu.allLunchMenus():
-            if aLunchMenu == None or isinstance(aLunchMenu, Exception):
-                # parse error, use current day of week
-                if now.weekday() < 5:
-                    minDeltaI = now.weekday()
-                else:
-                    minDeltaI = 4
-                break
-            td = now - aLunchMenu.lunchDate
-            delta = abs((td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6)
-            if delta < minDelta:
-                minDelta = delta
-                minDeltaI = i
-            i = i + 1
-                
-        self.combobox.setCurrentIndex(minDeltaI)
+        aDate = nearestDate(self._dates, LunchMenu.today())
+        if aDate != None:
+            self.combobox.setCurrentIndex(self._datePositions[aDate])
             
     def goTodayClicked(self):
         self.goToday()
         
     def isToggled(self):
-        index = self.menuNotebook.currentIndex()
-        return (index >= 5)
+        return self._toggled
+    
+    def showCurrentPage(self):
+        index = self.combobox.currentIndex()
+        pageIndex = index + self.combobox.count() if self.isToggled() else index
+        self.buildPage(pageIndex)
+        self.menuNotebook.setCurrentIndex(pageIndex)
+        self.leftButton.setEnabled(index > 0)
+        self.rightButton.setEnabled(index < self.combobox.count() - 1)
         
-    def changed_combo(self,index):
-        if self.isToggled():
-            self.menuNotebook.setCurrentIndex(index + 5)
-        else:
-            self.menuNotebook.setCurrentIndex(index)
-        self.leftButton.setEnabled(index != 0)
-        self.rightButton.setEnabled(index != 4)
+    def changed_combo(self, _index):
+        self.showCurrentPage()
    
     def toggleLanguage(self):
-        index = self.menuNotebook.currentIndex()
-        isToggle = (index >= 5)
-        if isToggle:
-            self.switchLanguageButton.setText(self.messages["toggleLanguage"])
-            index = index - 5
-        else:
+        self._toggled = not self._toggled
+        if self._toggled:
             self.switchLanguageButton.setText(self.messages["toggleLanguage2"])
-            index = index + 5
-        self.menuNotebook.setCurrentIndex(index)
+        else:
+            self.switchLanguageButton.setText(self.messages["toggleLanguage"])
+        self.showCurrentPage()
    
     def createButtonBar(self, parent):
         self.combobox = QComboBox(parent)
-        self.combobox.addItem(self.messages['monday'])
-        self.combobox.addItem(self.messages['tuesday'])
-        self.combobox.addItem(self.messages['wednesday'])
-        self.combobox.addItem(self.messages['thursday'])
-        self.combobox.addItem(self.messages['friday'])
+        self.combobox.setSizeAdjustPolicy(QComboBox.AdjustToContents)
         self.combobox.currentIndexChanged.connect(self.changed_combo)
         comboBoxHeight = self.combobox.sizeHint().height()
         
@@ -223,6 +193,9 @@ class LunchMenuWidget(QWidget):
                 
         return buttonBar
     
+    def dateLabel(self, aDate):
+        return formatDate(aDate, self.messages[u"dateFormatShortDisplayed"], self.messages)
+    
     def addMenuLine(self, parent, text, box, header = False):
         aLabel = QLabel(text, parent)
         if header:
@@ -231,118 +204,126 @@ class LunchMenuWidget(QWidget):
             aLabel.setFont(QFont(oldFont.family(), 13, QFont.Bold))
         box.addWidget(aLabel, 0, Qt.AlignBottom)
         
-    def addLocaleErrorPage(self, parent, box, toggle):
-        aLabel = QLabel(self.messages['parseLocaleError'], parent)
-        aLabel.setWordWrap(True)
-        box.addWidget(aLabel)
-        
-        aButton = QPushButton(self.messages['installLocaleButton'], parent)
-        if toggle:
-            aButton.clicked.connect(self.installLanguageSupportToggle)
-        else:
-            aButton.clicked.connect(self.installLanguageSupport)
-        box.addWidget(aButton)
-        
     def addExceptionPage(self, parent, box, error, _toggle):
         aLabel = QLabel(self.messages['otherException'] + u" " + unicode(error), parent)
         aLabel.setWordWrap(True)
         box.addWidget(aLabel)
         
-    def installLanguageSupportForLocale(self, locale):
-        locale = locale.partition("_")[0]
-        if subprocess.call(['gksu', "apt-get -q -y install language-pack-%s" % locale])!=0:
-            QMessageBox().critical(self.menuNotebook, "Installation Error", self.messages['installLocaleError'], buttons=QMessageBox.Ok, defaultButton=QMessageBox.Ok)
-        else:
-            QMessageBox().information(self.menuNotebook, "Success", self.messages['installLocaleSuccess'], buttons=QMessageBox.Ok, defaultButton=QMessageBox.Ok)
+    def pageLunchMenu(self, pageKey):
+        """Returns the LunchMenu, exception or None displayed on a page."""
+        toggle, aDate = pageKey
+        if aDate == None:
+            return self._error
+        return self._dateIndexes[1 if toggle else 0].get(aDate)
     
-    def installLanguageSupport(self):
-        self.installLanguageSupportForLocale(self.defaultLocaleString)
-    def installLanguageSupportToggle(self):
-        self.installLanguageSupportForLocale(self.messages['toggleLocale'])
-
-    def formatTitleAndDescription(self, title, description, keyInfo):
-        if title and description:
-            result = "%s, %s" % (title, description)
-        elif title:
-            result = title
+    def pageFingerprint(self, pageKey):
+        thisLunchMenu = self.pageLunchMenu(pageKey)
+        if type(thisLunchMenu) == LunchMenu:
+            return thisLunchMenu.fingerprint()
+        if isinstance(thisLunchMenu, Exception):
+            return (type(thisLunchMenu), unicode(thisLunchMenu))
+        return None
+    
+    def buildPage(self, pageIndex):
+        """Fills the (empty) notebook page on first use."""
+        pageKey = self._pageKeys[pageIndex]
+        if pageKey in self._builtPages:
+            return
+        self._builtPages.add(pageKey)
+        with metrics.timer(u"widget.buildPage"):
+            self._fillPage(pageIndex, pageKey)
+    
+    def _fillPage(self, pageIndex, pageKey):
+        snapshot = self._snapshot
+        toggle, _aDate = pageKey
+        if toggle:
+            curMessages, curAdditives = snapshot.toggleMessages, snapshot.toggleAdditives
         else:
-            result = description
+            curMessages, curAdditives = snapshot.messages, snapshot.additives
         
-        if keyInfo:
-            return "%s: %s" % (keyInfo.title(), result)
-        return result
-
-    def addMenuContent(self, parent, desc, menuContents, box, messages, additivesDict):
-        self.addMenuLine(parent, desc, box)
-        if desc in menuContents:
-            contentList = menuContents[desc]
+        pageWidget = self.menuNotebook.widget(pageIndex)
+        page = QVBoxLayout(pageWidget)
+        thisLunchMenu = self.pageLunchMenu(pageKey)
+        if thisLunchMenu != None and type(thisLunchMenu) == LunchMenu:
+            # one view per page, the HTML is shared with the CLI
+            html = LunchMenu.getLunchMenuHTML(thisLunchMenu.lunchDate, self.messages['toggleLocale'] if toggle else snapshot.defaultLocaleString, snapshot)
+            page.addWidget(LunchMenuView(pageWidget, html, curAdditives))
+        elif isinstance(thisLunchMenu, Exception):
+            self.addExceptionPage(pageWidget, page, thisLunchMenu, toggle)
         else:
-            contentList = [(messages[u'noContents'], None, [], None)]
-            log_debug("lunch menu does not contain key '%s'" % desc)
-        
-        textview = GrowingTextEdit(parent, messages, additivesDict)
-        textview.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        textview.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        textview.setLineWrapMode(QTextEdit.WidgetWidth)
-        textview.setReadOnly(True)
-        textview.document().setIndentWidth(10)
-        
-        if len(contentList) == 1:
-            title, description, additives, keyInfo = contentList[0]
-            textview.append(self.formatTitleAndDescription(title, description, keyInfo), additives)
-        elif len(contentList) > 1:
-            cursor = textview.textCursor()
-            listFormat = QTextListFormat()
-            listFormat.setStyle(QTextListFormat.ListDisc)
-            listFormat.setIndent(1)
-            cursor.createList(listFormat)
-            for title, description, additives, keyInfo in contentList:
-                textview.append(self.formatTitleAndDescription(title, description, keyInfo), additives)
-        
-        box.addWidget(textview, 0)
+            # no lunch menu in this language
+            self.addMenuLine(pageWidget, curMessages['noLunchToday'], page)
     
     def createNotebook(self):
-        self.combobox.setCurrentIndex(0)
+        """Updates the notebook to the current snapshot. Only pages whose
+        content changed are emptied (and rebuilt when shown again); if no
+        page changed, nothing is done."""
+        with metrics.timer(u"widget.createNotebook"):
+            self._updateNotebook()
+    
+    def _updateNotebook(self):
+        # use one snapshot for the whole notebook, it is not modified by refreshes
+        snapshot = self._snapshot
+        self.messages = snapshot.messages
+        self._dateIndexes = (LunchMenu.getDateIndex(snapshot.defaultLocaleString, snapshot, historyWeeks=self.historyWeeks),
+                             LunchMenu.getDateIndex(snapshot.messages["toggleLocale"], snapshot, historyWeeks=self.historyWeeks))
+        self._error = snapshot.getError()
+        dates = sorted(set(self._dateIndexes[0].dates()) | set(self._dateIndexes[1].dates()))
+        pageKeys = [(toggle, aDate) for toggle in (False, True) for aDate in dates or [None]]
+        pageFingerprints = dict((pageKey, self.pageFingerprint(pageKey)) for pageKey in pageKeys)
+        
+        catalogs = (snapshot.messages, snapshot.toggleMessages, snapshot.additives, snapshot.toggleAdditives)
+        catalogsChanged = catalogs != self._catalogs
+        if catalogsChanged:
+            # texts of all pages changed
+            self._catalogs = catalogs
+            self._pageFingerprints = {}
+        if pageKeys == self._pageKeys and pageFingerprints == self._pageFingerprints:
+            return
+        
+        oldPages = {}
         for _ in range(self.menuNotebook.count()):
-            self.menuNotebook.removeWidget(self.menuNotebook.widget(0))
-        curMessages = self.messages
-        curAdditives = self.additives
-        for index in range(10):
-            if index == 5:
-                try:
-                    if getPlatform() != PLATFORM_WINDOWS:
-                        locale.setlocale(locale.LC_TIME, (self.messages["toggleLocale"],"UTF-8"))
-                except:
-                    log_exception("error setting locale")
-                curMessages = self.toggleMessages
-                curAdditives = self.toggleAdditives
-            pageWidget = QWidget(self.menuNotebook)
-            page = QVBoxLayout(pageWidget)
-            thisLunchMenu = LunchMenu.allLunchMenus()[index]
-            if thisLunchMenu != None and type(thisLunchMenu) == LunchMenu:
-                title = curMessages['lunchMenuFor'] + u" " + thisLunchMenu.lunchDate.strftime(curMessages['dateFormatDisplayed']).decode("utf-8")
-                self.addMenuLine(pageWidget, title, page, True)
-                if thisLunchMenu.isValid():
-                    self.addMenuContent(pageWidget, curMessages['soupDisplayed'], thisLunchMenu.contents, page, curMessages, curAdditives)
-                    self.addMenuContent(pageWidget, curMessages['mainDishesDisplayed'], thisLunchMenu.contents, page, curMessages, curAdditives)
-                    self.addMenuContent(pageWidget, curMessages['supplementsDisplayed'], thisLunchMenu.contents, page, curMessages, curAdditives)
-                    self.addMenuContent(pageWidget, curMessages['dessertsDisplayed'], thisLunchMenu.contents, page, curMessages, curAdditives)
-                else:
-                    self.addMenuLine(pageWidget, curMessages['noLunchToday'], page)
-            elif type(thisLunchMenu) == locale.Error:
-                self.addLocaleErrorPage(pageWidget, page, index >= 5)
-                pass
-            elif isinstance(thisLunchMenu, Exception):
-                self.addExceptionPage(pageWidget, page, thisLunchMenu, index >= 5)
+            oldPage = self.menuNotebook.widget(0)
+            oldPages[self._pageKeys[len(oldPages)]] = oldPage
+            self.menuNotebook.removeWidget(oldPage)
+        
+        builtPages = set()
+        for pageKey in pageKeys:
+            page = oldPages.pop(pageKey, None)
+            if page != None and pageFingerprints[pageKey] == self._pageFingerprints.get(pageKey):
+                if pageKey in self._builtPages:
+                    builtPages.add(pageKey)
+            else:
+                if page != None:
+                    page.deleteLater()
+                # the page stays empty until it is shown
+                page = QWidget(self.menuNotebook)
+            self.menuNotebook.addWidget(page)
+        for oldPage in oldPages.values():
+            oldPage.deleteLater()
+        self._pageKeys = pageKeys
+        self._pageFingerprints = pageFingerprints
+        self._builtPages = builtPages
+        
+        if catalogsChanged or dates != self._dates:
+            selectedDate = self._dates[self.combobox.currentIndex()] if 0 <= self.combobox.currentIndex() < len(self._dates) else None
+            self._dates = dates
+            self._datePositions = dict((aDate, i) for i, aDate in enumerate(dates))
             
-            self.menuNotebook.addWidget(pageWidget)
-        try:
-            if getPlatform() != PLATFORM_WINDOWS:
-                locale.setlocale(locale.LC_TIME, (LunchMenu.defaultLocaleString,"UTF-8"))
-        except:
-            log_exception("error setting locale")
+            self.combobox.blockSignals(True)
+            self.combobox.clear()
+            for aDate in dates:
+                self.combobox.addItem(self.dateLabel(aDate))
+            if not dates:
+                # single page with the error or an empty lunch menu
+                self.combobox.addItem(self.messages['today'])
+            if selectedDate in self._datePositions:
+                self.combobox.setCurrentIndex(self._datePositions[selectedDate])
+            else:
+                self.goToday()
+            self.combobox.blockSignals(False)
         
-        self.goToday()
+        self.showCurrentPage()
 
 if __name__ == "__main__":
     def initWidget(window):
@@ -350,7 +331,7 @@ if __name__ == "__main__":
         w = LunchMenuWidget(window)
         AsyncCall(w,
                   LunchMenu.initialize,
-                  w.initializeLayout)("http://app.sap.eurest.de//mobileajax/data/46ba857b78fd4e51301592db98f8d9ae/all.json")
+                  w.updateLunchMenu)("http://app.sap.eurest.de//mobileajax/data/46ba857b78fd4e51301592db98f8d9ae/all.json")
         return w
     
     from lunchinator.plugin import iface_gui_plugin
@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
 from lunchinator.plugin import iface_general_plugin
 import threading
-import os
-import inspect
-import sys
-import time
+import Queue
 from eurest_lunch_menu import LunchMenu
-from lunchinator import get_server, log_error
+from eurest_lunch_menu.lunch_menu_metrics import metrics
+from lunchinator import get_server, log_error, log_exception
 
 class LunchStatisticsThread(threading.Thread):
+    # (category key base, table) of the statistics tables
+    tables = ((u"soup", "LUNCH_SOUP"),
+              (u"mainDishes", "LUNCH_MAIN"),
+              (u"supplements", "LUNCH_SIDE"),
+              (u"desserts", "LUNCH_DESSERT"))
+    
+    # seconds to wait before retrying if no database connection is available
+    retryInterval = 60
+    
+    # queued by stop() to wake up the thread
+    _STOP = object()
+    
     def __init__(self, connectionPlugin):
         threading.Thread.__init__(self)
+        self.daemon = True
         self.stopped = False
         self.connectionPlugin = connectionPlugin
         self.statDBErrorLogged = False
+        # published snapshots, filled by the lunch menu update listener
+        self._snapshots = Queue.Queue()
+        # date : fingerprint of the English lunch menus already written
+        self._fingerprints = {}
     
     def statsDB(self):
         stats = get_server().getDBConnection()
@@ -22,63 +37,123 @@ class LunchStatisticsThread(threading.Thread):
             log_error("Lunch Statistics Plugin: No database connection available.")
         return stats
     
-    def insertOrUpdate(self, aLunchMenu, aLunchEntry, tableName):
-        statDB = self.statsDB()
-        if not statDB:
+    def computeRows(self, lunchMenus, messages):
+        """Returns {(table, date) : [(text, additives)]} for the lunch menus."""
+        rows = {}
+        for aLunchMenu in lunchMenus:
+            if type(aLunchMenu) != LunchMenu:
+                continue
+            for keyBase, tableName in self.tables:
+                dishes = aLunchMenu.contents.get(messages[keyBase + u"Displayed"])
+                if dishes:
+                    rows[(tableName, aLunchMenu.lunchDate)] = [LunchMenu.extractAdditives(dish) for dish in dishes]
+        return rows
+    
+    def ingest(self, statDB, lunchMenus, messages, forceDates=()):
+        """Writes the lunch menus that are not stored yet or were stored
+        before today through the database plugin and commits once at the
+        end. Days in forceDates are rewritten in any case. Returns the
+        number of (table, date) entries written."""
+        rows = self.computeRows(lunchMenus, messages)
+        if not rows:
+            return 0
+        with metrics.timer(u"statistics.ingest"):
+            written = self._writeRows(statDB, rows, forceDates)
+        metrics.increment(u"statistics.days", written)
+        return written
+    
+    def _writeRows(self, statDB, rows, forceDates):
+        today = LunchMenu.today()
+        written = 0
+        for (tableName, lunchDate), textAndAdditivesList in sorted(rows.iteritems()):
+            lastUpdate = statDB.lastUpdateForLunchDay(lunchDate, tableName)
+            if lastUpdate != None and lastUpdate >= today and lunchDate not in forceDates:
+                continue
+            # insertLunchPart does not commit, the plugin owns the schema
+            statDB.insertLunchPart(lunchDate, textAndAdditivesList, lastUpdate != None, tableName)
+            metrics.increment(u"statistics.rows", len(textAndAdditivesList))
+            written += 1
+        if written:
+            statDB.commit()
+        return written
+    
+    def snapshotPublished(self, snapshot):
+        """Update listener, called from the refreshing thread."""
+        self._snapshots.put(snapshot)
+    
+    def _nextSnapshot(self, pending):
+        """Waits for the next published snapshot and returns the latest one
+        queued, or _STOP. If pending is not None, it is returned after
+        retryInterval seconds if nothing else arrives."""
+        try:
+            snapshot = self._snapshots.get(timeout=self.retryInterval if pending != None else None)
+        except Queue.Empty:
+            return pending
+        while snapshot is not self._STOP:
+            try:
+                snapshot = self._snapshots.get_nowait()
+            except Queue.Empty:
+                break
+        return snapshot
+    
+    def snapshotLunchMenus(self, snapshot):
+        """Returns the English lunch menus of all days of snapshot and the
+        days of the current week that already left the feed, sorted by date."""
+        lunchMenus = dict((aLunchMenu.lunchDate, aLunchMenu) for aLunchMenu in snapshot.getEnglishMenus() or ()
+                          if type(aLunchMenu) == LunchMenu)
+        # read from the history, so days that already left the feed
+        # this week are still counted
+        for aLunchMenu in LunchMenu.getLunchMenusForWeek(LunchMenu.today(), "en_US", snapshot):
+            lunchMenus.setdefault(aLunchMenu.lunchDate, aLunchMenu)
+        return [lunchMenus[aDate] for aDate in sorted(lunchMenus)]
+    
+    def writeSnapshot(self, statDB, snapshot):
+        """Writes the days of the snapshot and of the current week whose
+        content changed since they were last written."""
+        lunchMenus = [aLunchMenu for aLunchMenu in self.snapshotLunchMenus(snapshot)
+                      if self._fingerprints.get(aLunchMenu.lunchDate) != aLunchMenu.fingerprint()]
+        if not lunchMenus:
             return
-        lastUpdate = statDB.lastUpdateForLunchDay(aLunchMenu.lunchDate, tableName)
-        upToDate=True
-        doUpdate=False
-        
-        if lastUpdate == None:
-            upToDate = False
-        elif lastUpdate < LunchMenu.today():
-            upToDate = False
-            doUpdate = True
-            
-        if not upToDate:
-            textAndAdditivesList = []
-            if type(aLunchEntry) == list:
-                for anEntry in aLunchEntry:
-                    textAndAdditivesList.append(LunchMenu.extractAdditives(anEntry))
-            else:
-                textAndAdditivesList.append(LunchMenu.extractAdditives(aLunchEntry))
-            statDB.insertLunchPart(aLunchMenu.lunchDate, textAndAdditivesList, doUpdate, tableName)
+        # days written by this thread before changed, others may be up to date
+        forceDates = set(aLunchMenu.lunchDate for aLunchMenu in lunchMenus if aLunchMenu.lunchDate in self._fingerprints)
+        self.ingest(statDB, lunchMenus, snapshot.getEnglishMessages(), forceDates)
+        for aLunchMenu in lunchMenus:
+            self._fingerprints[aLunchMenu.lunchDate] = aLunchMenu.fingerprint()
     
     def run(self):
-        while True:
-            # wait until connection is open
-            # TODO can I wait until database connection plugin is activated? Maybe activate first?
-            time.sleep(10)
-            statDB = self.statsDB()
-            if self.stopped:
-                if statDB:
-                    statDB.close()
-                break
-            
-            if statDB != None:
-                englishLunchMenus = LunchMenu.getEnglishMenus()
-                englishMessages = LunchMenu.getEnglishMessages()
-                needCommit = False
-                for aLunchMenu in englishLunchMenus:
-                    if type(aLunchMenu) == LunchMenu:
-                        needCommit = True
-                        if englishMessages['soupDisplayed'] in aLunchMenu.contents:
-                            self.insertOrUpdate(aLunchMenu, aLunchMenu.contents[englishMessages['soupDisplayed']], "LUNCH_SOUP")
-                        if englishMessages['mainDishesDisplayed'] in aLunchMenu.contents:
-                            self.insertOrUpdate(aLunchMenu, aLunchMenu.contents[englishMessages['mainDishesDisplayed']], "LUNCH_MAIN")
-                        if englishMessages['supplementsDisplayed'] in aLunchMenu.contents:
-                            self.insertOrUpdate(aLunchMenu, aLunchMenu.contents[englishMessages['supplementsDisplayed']], "LUNCH_SIDE")
-                        if englishMessages['dessertsDisplayed'] in aLunchMenu.contents:
-                            self.insertOrUpdate(aLunchMenu, aLunchMenu.contents[englishMessages['dessertsDisplayed']], "LUNCH_DESSERT")
-                            
-                if needCommit:
-                    statDB.commit()
+        LunchMenu.addUpdateListener(self.snapshotPublished)
+        try:
+            if LunchMenu.isInitialized():
+                self._snapshots.put(LunchMenu.snapshot())
             
-            time.sleep(60*60)
+            pending = None
+            while True:
+                snapshot = self._nextSnapshot(pending)
+                if snapshot is self._STOP:
+                    break
+                pending = None
+                if not snapshot.isInitialized():
+                    continue
+                
+                statDB = self.statsDB()
+                if statDB == None:
+                    # wait until the connection is open
+                    pending = snapshot
+                    continue
+                try:
+                    self.writeSnapshot(statDB, snapshot)
+                except:
+                    log_exception("Lunch Statistics Plugin: Error writing lunch menus")
+        finally:
+            LunchMenu.removeUpdateListener(self.snapshotPublished)
+            statDB = get_server().getDBConnection()
+            if statDB:
+                statDB.close()
             
     def stop(self):
+        """Stops the thread immediately, also while it is waiting."""
         self.stopped = True
+        self._snapshots.put(self._STOP)
 
 class lunch_statistics(iface_general_plugin):
     def __init__(self):
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# Run from the repository root with lunchinator on the path:
+#     python -m unittest discover -s tests -t .
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import datetime
+import unittest
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_cache import LunchMenuCache
+from eurest_lunch_menu.lunch_menu_history import LunchMenuHistory
+
+def payload():
+    lunchDate = datetime.date(2015, 3, 2)
+    return {u"settings" : {u"additives" : [{u"id" : u"1", u"text" : {u"de" : u"Farbstoff", u"en" : u"colouring"}}]},
+            u"menu" : [{u"date" : int(time.mktime(lunchDate.timetuple())) + 12 * 3600,
+                        u"weekDay" : u"mon",
+                        u"counters" : [{u"title" : {u"de" : u"SUPPE", u"en" : u"SOUP"},
+                                        u"dishes" : [{u"title" : {u"de" : u"Linsensuppe", u"en" : u"Lentil soup"},
+                                                      u"additives" : [u"1"]}]}]}]}
+
+class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers with 304 if the ETag of the body is sent, like Eurest's server."""
+    protocol_version = "HTTP/1.1"
+    etag = '"v1"'
+    body = json.dumps(payload())
+    requests = []
+
+    def do_GET(self):
+        FeedHandler.requests.append(self.headers.getheader("If-None-Match"))
+        if self.headers.getheader("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *_args):
+        pass
+
+class LocalFeedTestCase(unittest.TestCase):
+    """Serves the feed from a local server; LunchMenu uses a temporary
+    cache and history."""
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.serverThread = threading.Thread(target=self.server.serve_forever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.url = u"http://127.0.0.1:%d/all.json" % self.server.server_port
+        FeedHandler.requests = []
+
+        LunchMenu._cache = LunchMenuCache(self.tempDir)
+        LunchMenu._history = LunchMenuHistory(os.path.join(self.tempDir, "history.sqlite"))
+        LunchMenu._snapshot = None
+
+    def tearDown(self):
+        LunchMenu.getHTTPClient().close()
+        self.server.shutdown()
+        self.server.server_close()
+        LunchMenu._snapshot = None
+        LunchMenu._cache = None
+        LunchMenu._history = None
+        LunchMenu._urls = ()
+        shutil.rmtree(self.tempDir, True)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import datetime
+import sqlite3
+
+class SQLiteStatisticsDB(object):
+    """Stand-in for get_server().getDBConnection() on SQLite.
+
+    Implements the part of the database plugin interface the statistics
+    use: lastUpdateForLunchDay, insertLunchPart (which, like the plugin's,
+    does not commit), commit and close. The calls are counted.
+    """
+    tableNames = ("LUNCH_SOUP", "LUNCH_MAIN", "LUNCH_SIDE", "LUNCH_DESSERT")
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        for tableName in self.tableNames:
+            self.conn.execute("CREATE TABLE %s (DATE DATE, NAME TEXT, ADDITIVES TEXT, LAST_UPDATE DATE)" % tableName)
+        self.conn.commit()
+        self.lastUpdateQueries = 0
+        self.inserts = 0
+        self.commits = 0
+
+    def lastUpdateForLunchDay(self, date, tableName):
+        self.lastUpdateQueries += 1
+        row = self.conn.execute("SELECT MAX(LAST_UPDATE) FROM %s WHERE DATE = ?" % tableName, (date,)).fetchone()
+        if row == None or row[0] == None:
+            return None
+        return datetime.datetime.strptime(str(row[0]), "%Y-%m-%d").date()
+
+    def insertLunchPart(self, date, textAndAdditivesList, update, table):
+        self.inserts += 1
+        if update:
+            self.conn.execute("DELETE FROM %s WHERE DATE = ?" % table, (date,))
+        for text, additives in textAndAdditivesList:
+            self.conn.execute("INSERT INTO %s (DATE, NAME, ADDITIVES, LAST_UPDATE) VALUES (?, ?, ?, ?)" % table,
+                              (date, text, additives, datetime.date.today()))
+
+    def commit(self):
+        self.commits += 1
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def rows(self, tableName):
+        return self.conn.execute("SELECT DATE, NAME, ADDITIVES, LAST_UPDATE FROM %s ORDER BY DATE, NAME" % tableName).fetchall()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from eurest_lunch_menu import LunchMenu
+from tests.local_feed import LocalFeedTestCase
+
+class FindDishesWithoutTest(LocalFeedTestCase):
+    monday = datetime.date(2015, 3, 2)
+    olderDay = datetime.date(2015, 2, 24)
+
+    def setUp(self):
+        LocalFeedTestCase.setUp(self)
+        self.snapshot = LunchMenu.initialize(self.url)
+        olderLunchMenu = LunchMenu()
+        olderLunchMenu.lunchDate = self.olderDay
+        olderLunchMenu.contents = self.snapshot.getEnglishMenus()[0].contents
+        LunchMenu.getHistory().storeDays(self.url, "en_US", [olderLunchMenu],
+                                         LunchMenu._categoryKeys(self.snapshot.getEnglishMessages()), {})
+
+    def titles(self, entries):
+        return [(entry.lunchDate, entry.dish.title) for entry in entries]
+
+    def test_days_of_the_snapshot(self):
+        self.assertEqual([(self.monday, u"Lentil soup")],
+                         self.titles(LunchMenu.findDishesWithout([u"2"], "en", [self.monday], self.snapshot)))
+        self.assertEqual([], LunchMenu.findDishesWithout([u"1"], "en", [self.monday], self.snapshot))
+
+    def test_older_days_do_not_change_the_shared_index(self):
+        sharedIndex = LunchMenu.getAdditiveIndex("en", self.snapshot)
+
+        entries = LunchMenu.findDishesWithout([u"2"], "en", [self.olderDay, self.monday], self.snapshot)
+
+        self.assertEqual([(self.olderDay, u"Lentil soup"), (self.monday, u"Lentil soup")], self.titles(entries))
+        self.assertFalse(sharedIndex.covers(self.olderDay))
+        self.assertEqual([], sharedIndex.dishesWithout([u"2"], [self.olderDay]))
+        self.assertTrue(LunchMenu.getAdditiveIndex("en", self.snapshot) is sharedIndex)
+
+if __name__ == "__main__":
+    unittest.main()
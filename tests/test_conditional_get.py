@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from eurest_lunch_menu import LunchMenu
+from tests.local_feed import FeedHandler, LocalFeedTestCase
+
+class ConditionalGetTest(LocalFeedTestCase):
+    def test_not_modified_keeps_the_published_lunch_menus(self):
+        first = LunchMenu.initialize(self.url)
+        self.assertTrue(first.isInitialized())
+        self.assertEqual([None], FeedHandler.requests)
+
+        second = LunchMenu.initialize(self.url)
+
+        # the cached validator was sent and the 304 did not replace the lunch menus
+        self.assertEqual([None, '"v1"'], FeedHandler.requests)
+        self.assertTrue(second.lunchMenus is first.lunchMenus)
+        self.assertTrue(second.lastUpdate >= first.lastUpdate)
+
+    def test_not_modified_uses_the_disk_cache_after_a_restart(self):
+        LunchMenu.initialize(self.url)
+        # a new process only has the disk cache
+        LunchMenu._snapshot = None
+
+        snapshot = LunchMenu.initialize(self.url)
+
+        self.assertEqual([None, '"v1"'], FeedHandler.requests)
+        self.assertTrue(snapshot.isInitialized())
+        soup = snapshot.getEnglishMenus()[0].contents[snapshot.getEnglishMessages()[u"soupDisplayed"]]
+        self.assertEqual(u"Lentil soup", soup[0].title)
+
+    def test_not_modified_keeps_what_was_derived_from_the_lunch_menus(self):
+        first = LunchMenu.initialize(self.url)
+        monday = datetime.date(2015, 3, 2)
+        export = LunchMenu.exportLunchMenus(monday, monday, ["en"], u"json", first)
+        html = LunchMenu.getLunchMenuHTML(monday, "en", first)
+
+        second = LunchMenu.initialize(self.url)
+
+        self.assertTrue(second is not first)
+        self.assertTrue(second.cache is first.cache)
+        self.assertTrue(LunchMenu.getLunchMenuHTML(monday, "en", second) is html)
+        self.assertEqual(export, LunchMenu.exportLunchMenus(monday, monday, ["en"], u"json", second))
+
+    def test_changed_lunch_menus_get_their_own_cache(self):
+        first = LunchMenu.initialize(self.url)
+        monday = datetime.date(2015, 3, 2)
+        FeedHandler.etag = '"v2"'
+        try:
+            second = LunchMenu.initialize(self.url)
+        finally:
+            FeedHandler.etag = '"v1"'
+
+        self.assertTrue(second.cache is not first.cache)
+        # readers of either snapshot keep their own values
+        firstHTML = LunchMenu.getLunchMenuHTML(monday, "en", first)
+        secondHTML = LunchMenu.getLunchMenuHTML(monday, "en", second)
+        self.assertTrue(LunchMenu.getLunchMenuHTML(monday, "en", first) is firstHTML)
+        self.assertTrue(LunchMenu.getLunchMenuHTML(monday, "en", second) is secondHTML)
+
+if __name__ == "__main__":
+    unittest.main()
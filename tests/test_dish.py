@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import unittest
+from eurest_lunch_menu.lunch_menu_dish import LunchDish, StringTable
+
+class LunchDishTest(unittest.TestCase):
+    def test_additives_keep_the_order_of_the_dish(self):
+        dish = LunchDish.create(u"Curry", None, [u"9", u"1", u"3"], None)
+        self.assertEqual((u"9", u"1", u"3"), dish.additives)
+        self.assertEqual((u"3", u"1"), LunchDish.create(u"Curry", None, [u"3", u"1"], None).additives)
+        self.assertEqual((u"Curry", None, (u"9", u"1", u"3"), None), tuple(dish))
+        self.assertTrue(dish.hasAdditive(u"1"))
+        self.assertFalse(dish.hasAdditive(u"2"))
+
+    def test_equal_dishes_share_one_instance(self):
+        dish = LunchDish.create(u"Curry", u"with rice", [u"1"], u"vegan")
+        self.assertTrue(LunchDish.create(u"Curry", u"with rice", (u"1",), u"vegan") is dish)
+        self.assertFalse(LunchDish.create(u"Curry", u"with rice", None, u"vegan") is dish)
+
+    def test_titles_are_shared_between_dishes(self):
+        first = LunchDish.create(u"".join([u"Lentil", u" soup"]), None, [u"1"], None)
+        second = LunchDish.create(u"".join([u"Lentil", u" soup"]), None, [u"2"], None)
+        self.assertTrue(first.title is second.title)
+        self.assertTrue(first.additives is not second.additives)
+
+    def test_bounded_string_table_starts_over(self):
+        table = StringTable(maxSize=2)
+        first = table.intern(u"".join([u"a", u"b"]))
+        self.assertTrue(table.intern(u"".join([u"a", u"b"])) is first)
+        table.intern(u"c")
+        table.intern(u"d")
+        self.assertTrue(table.intern(u"".join([u"a", u"b"])) is not first)
+        self.assertEqual(None, table.intern(None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_dish import LunchDish
+from eurest_lunch_menu.lunch_menu_history import LunchMenuHistory
+
+class LunchMenuHistorySearchTest(unittest.TestCase):
+    monday = datetime.date(2015, 3, 2)
+
+    def setUp(self):
+        self.history = LunchMenuHistory(":memory:")
+        for localeString, titles in (("de_DE", [u"Käsespätzle", u"Hähnchen Curry"]),
+                                     ("en_US", [u"Cheese noodles", u"Chicken curry"])):
+            lunchMenus = []
+            for day in range(3):
+                aLunchMenu = LunchMenu()
+                aLunchMenu.lunchDate = self.monday + datetime.timedelta(days=day)
+                aLunchMenu.contents = {u"Main" : [LunchDish.create(title, u"mit Reis" if day == 1 else None, None, None) for title in titles]}
+                lunchMenus.append(aLunchMenu)
+            self.history.storeDays(u"canteen", localeString, lunchMenus, {u"Main" : u"mainDishes"}, {})
+
+    def tearDown(self):
+        self.history.close()
+
+    def test_newest_first_in_both_languages(self):
+        result = self.history.search(u"curry")
+        self.assertEqual([(self.monday + datetime.timedelta(days=day), localeKey) for day in (2, 1, 0) for localeKey in (u"en", u"de")],
+                         [(row[1], row[2]) for row in result])
+        self.assertEqual((u"canteen", u"mainDishes", u"Chicken curry", None, None, None), (result[0][0],) + result[0][3:])
+
+    def test_every_word_has_to_match_as_a_prefix(self):
+        self.assertEqual([u"Hähnchen Curry"], [row[4] for row in self.history.search(u"cur hahn reis")])
+        self.assertEqual([], self.history.search(u"curry noodles"))
+
+    def test_umlauts_are_folded(self):
+        self.assertEqual(3, len(self.history.search(u"kasespatzle")))
+        self.assertEqual(3, len(self.history.search(u"kaesespaetzle")))
+
+    def test_locale_and_dates_are_filtered(self):
+        tuesday = self.monday + datetime.timedelta(days=1)
+        result = self.history.search(u"c", localeString="de_DE", startDate=tuesday, endDate=tuesday)
+        self.assertEqual([u"Hähnchen Curry"], [row[4] for row in result])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_refresher import LunchMenuRefresher
+
+def _waitFor(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.005)
+    return condition()
+
+class LunchMenuRefresherTest(unittest.TestCase):
+    def setUp(self):
+        # seconds until the lunch menu is outdated, a refresh makes it current
+        self.secondsUntilOutdated = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.refresher = LunchMenuRefresher(self.refresh, lambda: self.secondsUntilOutdated)
+
+    def tearDown(self):
+        self.refresher.stop()
+        self.refresher.join(5)
+
+    def refresh(self):
+        self.refreshes += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("offline")
+        self.secondsUntilOutdated = 3600
+
+    def test_outdated_lunch_menu_is_refreshed_once_on_start(self):
+        self.refresher.start()
+        self.assertTrue(_waitFor(lambda: self.refreshes == 1))
+        time.sleep(0.05)
+        self.assertEqual(1, self.refreshes)
+
+    def test_current_lunch_menu_is_not_refreshed_on_start(self):
+        self.secondsUntilOutdated = 3600
+        self.refresher.start()
+        time.sleep(0.05)
+        self.assertEqual(0, self.refreshes)
+
+    def test_wake_up_refreshes_only_if_outdated(self):
+        self.secondsUntilOutdated = 3600
+        self.refresher.start()
+        # readers wake the thread while the lunch menu is still current
+        for _ in range(10):
+            self.refresher.refreshNow()
+        time.sleep(0.05)
+        self.assertEqual(0, self.refreshes)
+
+        self.secondsUntilOutdated = 0
+        self.refresher.refreshNow()
+        self.assertTrue(_waitFor(lambda: self.refreshes == 1))
+        time.sleep(0.05)
+        self.assertEqual(1, self.refreshes)
+
+    def test_failed_refresh_is_retried(self):
+        self.refresher.retryInterval = 0.01
+        self.failures = 2
+        self.refresher.start()
+        self.assertTrue(_waitFor(lambda: self.refreshes == 3))
+        time.sleep(0.05)
+        self.assertEqual(3, self.refreshes)
+
+    def test_stop_ends_a_waiting_thread(self):
+        self.secondsUntilOutdated = 3600
+        self.refresher.start()
+        self.refresher.stop()
+        self.refresher.join(5)
+        self.assertFalse(self.refresher.is_alive())
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.initializeFromCache = LunchMenu.__dict__["initializeFromCache"]
+        self.requestRefresh = LunchMenu.__dict__["requestRefresh"]
+        # the URLs changed while the cache was read, nothing was published
+        LunchMenu.initializeFromCache = classmethod(lambda cls, url=None: False)
+        LunchMenu.requestRefresh = classmethod(lambda cls: None)
+        LunchMenu._snapshot = None
+        LunchMenu._urls = (u"http://localhost/other.json",)
+
+    def tearDown(self):
+        LunchMenu.initializeFromCache = self.initializeFromCache
+        LunchMenu.requestRefresh = self.requestRefresh
+        LunchMenu._snapshot = None
+        LunchMenu._urls = ()
+
+    def test_snapshot_is_never_none(self):
+        snapshot = LunchMenu.snapshot()
+        self.assertFalse(snapshot == None)
+        self.assertFalse(snapshot.isInitialized())
+        self.assertEqual((u"http://localhost/other.json",), snapshot.urls)
+        self.assertEqual(None, LunchMenu.getEnglishMenus())
+        self.assertEqual({}, LunchMenu.additives())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import datetime
+import gzip
+import httplib
+import json
+import os
+import unittest
+from StringIO import StringIO
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_history import LunchMenuHistory
+from eurest_lunch_menu.lunch_menu_server import LunchMenuServer, ServedResource, ResourceUnavailable
+from tests.local_feed import LocalFeedTestCase
+
+class LunchMenuServerTest(unittest.TestCase):
+    body = json.dumps({u"date" : u"2015-03-02", u"title" : u"Käsespätzle"}, ensure_ascii=False).encode("utf-8")
+
+    def resourceForPath(self, path):
+        self.paths.append(path)
+        if path == "/unavailable":
+            raise ResourceUnavailable()
+        if path == "/broken":
+            raise ValueError("broken")
+        if path == "/day.json":
+            return self.resource
+        return None
+
+    def setUp(self):
+        self.paths = []
+        self.resource = ServedResource.create(self.body, "application/json; charset=utf-8")
+        self.server = LunchMenuServer(0, self.resourceForPath, host="127.0.0.1")
+        self.server.start()
+        self.connection = httplib.HTTPConnection("127.0.0.1", self.server.port, timeout=10)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def request(self, path, method="GET", headers={}):
+        self.connection.request(method, path, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_unknown_path_is_not_found(self):
+        response, body = self.request("/nothing.json")
+        self.assertEqual(404, response.status)
+        self.assertEqual("", body)
+
+    def test_unavailable_resource_is_service_unavailable(self):
+        response, _body = self.request("/unavailable")
+        self.assertEqual(503, response.status)
+
+    def test_error_is_internal_server_error(self):
+        response, _body = self.request("/broken")
+        self.assertEqual(500, response.status)
+
+    def test_query_is_ignored(self):
+        response, body = self.request("/day.json?x=1")
+        self.assertEqual(200, response.status)
+        self.assertEqual(self.body, body)
+        self.assertEqual(["/day.json"], self.paths)
+
+    def test_plain_response_with_etag(self):
+        response, body = self.request("/day.json")
+        self.assertEqual(200, response.status)
+        self.assertEqual(self.body, body)
+        self.assertEqual(None, response.getheader("Content-Encoding"))
+        self.assertEqual('"%s"' % self.resource.etag, response.getheader("ETag"))
+        self.assertEqual("Accept-Encoding", response.getheader("Vary"))
+
+    def test_gzip_response_has_its_own_etag(self):
+        response, body = self.request("/day.json", headers={"Accept-Encoding" : "deflate, gzip"})
+        self.assertEqual(200, response.status)
+        self.assertEqual("gzip", response.getheader("Content-Encoding"))
+        self.assertEqual('"%s-gz"' % self.resource.etag, response.getheader("ETag"))
+        self.assertEqual(self.body, gzip.GzipFile(fileobj=StringIO(body)).read())
+
+    def test_gzip_is_not_sent_if_not_acceptable(self):
+        response, body = self.request("/day.json", headers={"Accept-Encoding" : "gzip;q=0"})
+        self.assertEqual(None, response.getheader("Content-Encoding"))
+        self.assertEqual(self.body, body)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.request("/day.json")[0].getheader("ETag")
+        response, body = self.request("/day.json", headers={"If-None-Match" : '"other", %s' % etag})
+        self.assertEqual(304, response.status)
+        self.assertEqual("", body)
+        self.assertEqual(etag, response.getheader("ETag"))
+
+    def test_etag_of_other_encoding_is_modified(self):
+        etag = self.request("/day.json")[0].getheader("ETag")
+        response, _body = self.request("/day.json", headers={"If-None-Match" : etag, "Accept-Encoding" : "gzip"})
+        self.assertEqual(200, response.status)
+
+    def test_head_has_no_body(self):
+        response, body = self.request("/day.json", method="HEAD")
+        self.assertEqual(200, response.status)
+        self.assertEqual(str(len(self.body)), response.getheader("Content-Length"))
+        self.assertEqual("", body)
+
+class _CountingHistory(LunchMenuHistory):
+    def __init__(self, path):
+        LunchMenuHistory.__init__(self, path)
+        self.queries = 0
+
+    def dates(self, *args, **kwargs):
+        self.queries += 1
+        return LunchMenuHistory.dates(self, *args, **kwargs)
+
+    def dishRows(self, *args, **kwargs):
+        self.queries += 1
+        return LunchMenuHistory.dishRows(self, *args, **kwargs)
+
+class ServedResourceTest(LocalFeedTestCase):
+    """getServedResource with lunch menus read from a local server."""
+    def test_days(self):
+        LunchMenu._history = _CountingHistory(os.path.join(self.tempDir, "counting.sqlite"))
+        snapshot = LunchMenu.initialize(self.url)
+
+        resource = LunchMenu.getServedResource(u"/menus/2015-03-02/en.json", snapshot)
+        self.assertEqual(u"2015-03-02", json.loads(resource.body)[u"date"])
+        self.assertTrue(LunchMenu.getServedResource(u"/menus/2015-03-02/en.json", snapshot) is resource)
+        self.assertEqual(None, LunchMenu.getServedResource(u"/menus/2015-13-45/en.json", snapshot))
+        self.assertEqual(None, LunchMenu.getServedResource(u"/menus/2015-03-02/fr.json", snapshot))
+
+        # unknown days are answered from the dates read once
+        queries = LunchMenu._history.queries
+        for day in range(1, 29):
+            self.assertEqual(None, LunchMenu.getServedResource(u"/menus/2014-02-%02d/de.json" % day, snapshot))
+        self.assertTrue(LunchMenu._history.queries <= queries + 1)
+
+    def test_days_from_the_history(self):
+        snapshot = LunchMenu.initialize(self.url)
+        # a day that left the feed
+        lunchMenu = LunchMenu()
+        lunchMenu.lunchDate = datetime.date(2015, 2, 27)
+        lunchMenu.contents = snapshot.getEnglishMenus()[0].contents
+        LunchMenu.getHistory().storeDays(self.url, "en_US", [lunchMenu], LunchMenu._categoryKeys(snapshot.getEnglishMessages()), {})
+        LunchMenu._snapshot = None
+        snapshot = LunchMenu.initialize(self.url)
+
+        resource = LunchMenu.getServedResource(u"/menus/2015-02-27/en.json", snapshot)
+        self.assertEqual(u"2015-02-27", json.loads(resource.body)[u"date"])
+
+if __name__ == "__main__":
+    unittest.main()
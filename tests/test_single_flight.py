@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from eurest_lunch_menu.lunch_menu_single_flight import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.singleFlight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slowCall(self, result):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def runConcurrently(self, key, result, followers=5):
+        """Starts a leader and followers for key, returns their outcomes."""
+        outcomes = []
+        def call():
+            try:
+                outcomes.append(self.singleFlight.do(key, self.slowCall, result))
+            except Exception as e:
+                outcomes.append(e)
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(self.singleFlight.isRunning(key))
+        for _ in range(followers):
+            thread = threading.Thread(target=call)
+            thread.start()
+            threads.append(thread)
+        # the followers are waiting for the leader
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_are_coalesced(self):
+        result = object()
+        outcomes = self.runConcurrently("url", result)
+        self.assertEqual(1, self.calls)
+        self.assertEqual(6, len(outcomes))
+        self.assertTrue(all(outcome is result for outcome in outcomes))
+        self.assertFalse(self.singleFlight.isRunning("url"))
+
+    def test_exception_is_raised_in_every_caller(self):
+        error = IOError("offline")
+        outcomes = self.runConcurrently("url", error)
+        self.assertEqual(1, self.calls)
+        self.assertEqual([error] * 6, outcomes)
+
+    def test_later_calls_and_other_keys_execute_again(self):
+        self.release.set()
+        self.assertEqual(1, self.singleFlight.do("a", self.slowCall, 1))
+        self.assertEqual(2, self.singleFlight.do("a", self.slowCall, 2))
+        self.assertEqual(3, self.singleFlight.do("b", self.slowCall, 3))
+        self.assertEqual(3, self.calls)
+
+if __name__ == "__main__":
+    unittest.main()
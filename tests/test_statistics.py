@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_dish import LunchDish
+from eurest_lunch_menu_statistics import LunchStatisticsThread
+from tests.sqlite_statistics_db import SQLiteStatisticsDB
+
+class LunchStatisticsIngestTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = LunchMenu.loadMessagesForLocale("en_US")
+        self.statDB = SQLiteStatisticsDB()
+        self.thread = LunchStatisticsThread(None)
+        self.monday = datetime.date(2015, 3, 2)
+
+    def tearDown(self):
+        self.statDB.close()
+
+    def lunchMenu(self, lunchDate, soup=u"Lentil soup"):
+        aLunchMenu = LunchMenu()
+        aLunchMenu.lunchDate = lunchDate
+        aLunchMenu.contents = {self.messages[u"soupDisplayed"] : [LunchDish.create(soup, None, [u"1"], None)],
+                               self.messages[u"mainDishesDisplayed"] : [LunchDish.create(u"Chicken curry", None, None, None),
+                                                                        LunchDish.create(u"Cheese noodles", u"with onions", None, u"vegetarian")]}
+        return aLunchMenu
+
+    def week(self, **kwargs):
+        return [self.lunchMenu(self.monday + datetime.timedelta(days=i), **kwargs) for i in range(5)]
+
+    def test_new_days_are_written_with_one_commit(self):
+        written = self.thread.ingest(self.statDB, self.week(), self.messages)
+
+        # one lookup and one insert per table and day
+        self.assertEqual(10, written)
+        self.assertEqual(10, self.statDB.lastUpdateQueries)
+        self.assertEqual(10, self.statDB.inserts)
+        self.assertEqual(1, self.statDB.commits)
+        soupRows = self.statDB.rows("LUNCH_SOUP")
+        self.assertEqual(5, len(soupRows))
+        self.assertEqual((u"Lentil soup", u"1"), tuple(soupRows[0][1:3]))
+        self.assertEqual([u"Chicken curry", u"Vegetarian: Cheese noodles, with onions"],
+                         [row[1] for row in self.statDB.rows("LUNCH_MAIN")][:2])
+
+    def test_days_written_today_are_skipped(self):
+        self.thread.ingest(self.statDB, self.week(), self.messages)
+        self.statDB.lastUpdateQueries = self.statDB.inserts = self.statDB.commits = 0
+
+        written = self.thread.ingest(self.statDB, self.week(soup=u"Tomato soup"), self.messages)
+
+        self.assertEqual(0, written)
+        self.assertEqual(0, self.statDB.inserts)
+        self.assertEqual(0, self.statDB.commits)
+        self.assertEqual(u"Lentil soup", self.statDB.rows("LUNCH_SOUP")[0][1])
+
+    def test_outdated_and_forced_days_are_replaced(self):
+        self.thread.ingest(self.statDB, self.week(), self.messages)
+        # Monday was last written yesterday
+        self.statDB.conn.execute("UPDATE LUNCH_SOUP SET LAST_UPDATE = ? WHERE DATE = ?",
+                                 (LunchMenu.today() - datetime.timedelta(days=1), self.monday))
+        self.statDB.conn.commit()
+        self.statDB.lastUpdateQueries = self.statDB.inserts = self.statDB.commits = 0
+
+        tuesday = self.monday + datetime.timedelta(days=1)
+        written = self.thread.ingest(self.statDB, self.week(soup=u"Tomato soup"), self.messages, forceDates=[tuesday])
+
+        # Monday's soup, Tuesday's soup and main dishes
+        self.assertEqual(3, written)
+        self.assertEqual(3, self.statDB.inserts)
+        self.assertEqual(1, self.statDB.commits)
+        soupRows = self.statDB.rows("LUNCH_SOUP")
+        self.assertEqual(5, len(soupRows))
+        self.assertEqual([u"Tomato soup", u"Tomato soup", u"Lentil soup"], [row[1] for row in soupRows[:3]])
+
+    def test_nothing_is_committed_before_the_end(self):
+        commits = []
+        insertLunchPart = self.statDB.insertLunchPart
+        def insertAndCount(*args):
+            commits.append(self.statDB.commits)
+            insertLunchPart(*args)
+        self.statDB.insertLunchPart = insertAndCount
+
+        self.thread.ingest(self.statDB, self.week(), self.messages)
+
+        self.assertEqual([0] * 10, commits)
+        self.assertEqual(1, self.statDB.commits)
+
+if __name__ == "__main__":
+    unittest.main()
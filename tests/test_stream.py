@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import time
+import unittest
+from StringIO import StringIO
+from eurest_lunch_menu import LunchMenu
+from eurest_lunch_menu.lunch_menu_stream import JSONStreamReader
+
+def _payload():
+    lunchDate = datetime.date(2015, 3, 2)
+    return {u"settings" : {u"additives" : [{u"id" : u"1", u"text" : {u"de" : u"Farbstoff", u"en" : u"colouring"}}],
+                           u"version" : 2.5},
+            u"menu" : [{u"date" : int(time.mktime(lunchDate.timetuple())) + 12 * 3600,
+                        u"weekDay" : u"mon",
+                        u"counters" : [{u"title" : {u"de" : u"SUPPE", u"en" : u"SOUP"},
+                                        u"dishes" : [{u"title" : {u"de" : u"Käsesuppe", u"en" : u"Cheese soup"},
+                                                      u"additives" : [u"1"]}]}]}]}
+
+class _ShortReads(object):
+    """Returns at most chunkSize bytes per read, like a slow connection."""
+    def __init__(self, data, chunkSize):
+        self._inFile = StringIO(data)
+        self._chunkSize = chunkSize
+
+    def read(self, size=-1):
+        return self._inFile.read(min(size, self._chunkSize) if size >= 0 else self._chunkSize)
+
+class JSONStreamReaderTest(unittest.TestCase):
+    chunkSizes = range(1, 8)
+
+    def members(self, text, chunkSize, arrayKeys=(u"menu",)):
+        reader = JSONStreamReader(StringIO(text.encode("utf-8")), chunkSize=chunkSize)
+        return list(reader.iterMembers(arrayKeys=arrayKeys))
+
+    def test_numbers_cut_at_chunk_boundaries(self):
+        text = u'{"menu": [1, 2.5, -3, 1e5, 2.5E-3, 10], "n": 42}'
+        for chunkSize in self.chunkSizes:
+            self.assertEqual([(u"menu", 1, True), (u"menu", 2.5, True), (u"menu", -3, True),
+                              (u"menu", 1e5, True), (u"menu", 2.5e-3, True), (u"menu", 10, True),
+                              (u"n", 42, False)],
+                             self.members(text, chunkSize), "chunkSize=%d" % chunkSize)
+
+    def test_number_at_end_of_input(self):
+        for chunkSize in self.chunkSizes:
+            reader = JSONStreamReader(StringIO("12.75"), chunkSize=chunkSize)
+            self.assertEqual(12.75, reader._decodeValue(), "chunkSize=%d" % chunkSize)
+
+    def test_multi_byte_characters_cut_at_chunk_boundaries(self):
+        text = u'{"menu": ["Käse", "Spätzle €"], "title": "Grüße"}'
+        for chunkSize in self.chunkSizes:
+            self.assertEqual([(u"menu", u"Käse", True), (u"menu", u"Spätzle €", True), (u"title", u"Grüße", False)],
+                             self.members(text, chunkSize), "chunkSize=%d" % chunkSize)
+
+    def test_malformed_number_is_rejected(self):
+        for chunkSize in self.chunkSizes:
+            self.assertRaises(ValueError, self.members, u'{"menu": [2.x]}', chunkSize)
+
+    def test_lunch_menus_are_equal_for_all_chunk_sizes(self):
+        body = json.dumps(_payload(), ensure_ascii=False).encode("utf-8")
+        localesAndMessages = [(localeStr, LunchMenu.loadMessagesForLocale(localeStr)) for localeStr in ("de_DE", "en_US")]
+        for chunkSize in self.chunkSizes:
+            additivesDicts = [{}, {}]
+            days = list(LunchMenu.iterLunchMenus(_ShortReads(body, chunkSize), localesAndMessages, additivesDicts))
+            self.assertEqual(1, len(days))
+            germanMenu, englishMenu = days[0]
+            self.assertEqual(datetime.date(2015, 3, 2), germanMenu.lunchDate)
+            self.assertEqual(u"Käsesuppe", germanMenu.contents[localesAndMessages[0][1][u"soupDisplayed"]][0].title)
+            self.assertEqual(u"Cheese soup", englishMenu.contents[localesAndMessages[1][1][u"soupDisplayed"]][0].title)
+            self.assertEqual([{u"1" : u"Farbstoff"}, {u"1" : u"colouring"}], additivesDicts)
+
+if __name__ == "__main__":
+    unittest.main()